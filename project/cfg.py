@@ -1,8 +1,12 @@
 from pyformlang.cfg import CFG, Epsilon, Terminal, Variable
-from networkx import MultiDiGraph
+from networkx import DiGraph, MultiDiGraph, condensation, topological_sort
+from collections import defaultdict, namedtuple
 from typing import Iterable
 from math import log2, ceil
 from project import graphs
+from project.ecfg import ECFG
+from project.fa import graph_to_boolean_fa
+from project.rfa import Nonterminal, RFA, intersect_with_fa
 import scipy.sparse as sp
 import numpy as np
 
@@ -44,7 +48,7 @@ def from_file(path: str) -> CFG:
 
 
 def hellings(
-    graph: MultiDiGraph | str,
+    graph: MultiDiGraph | graphs.CSRGraph | str,
     cfg: CFG | str,
 ) -> set[tuple[int, Variable, int]]:
     """
@@ -55,22 +59,53 @@ def hellings(
 
     If graph specified by string, it loaded from dataset by name using project.graphs.load_by_name.
     If CFG specified by string, it loaded from text using CFG.from_text.
+    CSRGraph is converted to MultiDiGraph, see project.graphs.to_multidigraph.
     """
 
     if isinstance(graph, str):
         graph = graphs.load_by_name(graph)
 
+    graph = graphs.to_multidigraph(graph)
+
     if isinstance(cfg, str):
         cfg = CFG.from_text(cfg)
 
     cfg = to_wcnf(cfg)
 
+    # heads of binary productions by body, and other body nonterminal of binary productions
+    # by left and right nonterminal of body respectively
+    heads = defaultdict(list)
+    right_by_left = defaultdict(set)
+    left_by_right = defaultdict(set)
+
+    for p in cfg.productions:
+        if len(p.body) == 2:
+            b, c = p.body
+
+            heads[(b, c)].append(p.head)
+            right_by_left[b].add(c)
+            left_by_right[c].add(b)
+
     r = set()
+    by_source = defaultdict(lambda: defaultdict(set))
+    by_target = defaultdict(lambda: defaultdict(set))
+    m = []
+
+    def add(v, n, u):
+        if (v, n, u) in r:
+            return
+
+        r.add((v, n, u))
+        by_source[v][n].add(u)
+        by_target[u][n].add(v)
+        m.append((v, n, u))
+
     for p in cfg.productions:
         name = p.head
 
         if len(p.body) == 0:
-            r |= {(v, name, v) for v in graph.nodes}
+            for v in graph.nodes:
+                add(v, name, v)
 
         if len(p.body) != 1:
             continue
@@ -79,101 +114,275 @@ def hellings(
         if isinstance(term, Terminal):
             term = term.value
 
-            r |= {(v, name, u) for (v, u, l) in graph.edges(data="label") if l == term}
-
-    m = list(r)
+            for (v, u, l) in graph.edges(data="label"):
+                if l == term:
+                    add(v, name, u)
 
     while len(m) > 0:
         v, ni, u = m.pop()
 
-        new_r = set()
-        for v1, nj, u1 in r:
-            if u1 != v:
-                continue
+        for nj in left_by_right[ni]:
+            for v1 in list(by_target[v].get(nj, ())):
+                for nk in heads[(nj, ni)]:
+                    add(v1, nk, u)
 
-            for p in cfg.productions:
-                if len(p.body) != 2:
-                    continue
+        for nj in right_by_left[ni]:
+            for v1 in list(by_source[u].get(nj, ())):
+                for nk in heads[(ni, nj)]:
+                    add(v, nk, v1)
 
-                if p.body != [nj, ni]:
-                    continue
+    return r
 
-                nk = p.head
-                if (v1, nk, u) in r:
-                    continue
 
-                m.append((v1, nk, u))
-                new_r.add((v1, nk, u))
+def demand_hellings(
+    graph: MultiDiGraph | graphs.CSRGraph | str,
+    cfg: CFG | str,
+    start_nodes: Iterable[any],
+    nonterminal: Variable = None,
+) -> set[tuple[int, Variable, int]]:
+    """
+    Demand-driven variant of Hellings' algorithm: returns only tuples (vertex, nonterminal,
+    vertex) that are required to find all vertices reachable from `start_nodes` by
+    `nonterminal` (start symbol of grammar by default).
 
-        for u1, nj, v1 in r:
-            if u1 != u:
-                continue
+    Pair (nonterminal, vertex) is demanded if it is (`nonterminal`, start vertex), or
+    it is (B, v) and (A, v) is demanded for production A -> B C, or it is (C, w) and
+    (A, v) is demanded for production A -> B C and w reachable from v by B.
+    Tuples are derived only from demanded pairs.
 
-            for p in cfg.productions:
-                if len(p.body) != 2:
-                    continue
+    If graph specified by string, it loaded from dataset by name using project.graphs.load_by_name.
+    If CFG specified by string, it loaded from text using CFG.from_text.
+    CSRGraph is converted to MultiDiGraph, see project.graphs.to_multidigraph.
+    """
 
-                if p.body != [ni, nj]:
-                    continue
+    if isinstance(graph, str):
+        graph = graphs.load_by_name(graph)
 
-                nk = p.head
-                if (v, nk, v1) in r:
-                    continue
+    graph = graphs.to_multidigraph(graph)
+
+    if isinstance(cfg, str):
+        cfg = CFG.from_text(cfg)
+
+    if nonterminal is None:
+        nonterminal = cfg.start_symbol
+
+    cfg = to_wcnf(cfg)
+
+    epsilon_heads = set()
+    terminals = defaultdict(list)
+    bodies = defaultdict(list)
+    heads_by_left = defaultdict(list)
+    heads_by_right = defaultdict(list)
+
+    for p in cfg.productions:
+        if len(p.body) == 0:
+            epsilon_heads.add(p.head)
+
+        elif len(p.body) == 1 and isinstance(p.body[0], Terminal):
+            terminals[p.head].append(p.body[0].value)
+
+        elif len(p.body) == 2:
+            b, c = p.body
+
+            bodies[p.head].append((b, c))
+            heads_by_left[b].append((p.head, c))
+            heads_by_right[c].append((p.head, b))
+
+    out_edges = defaultdict(lambda: defaultdict(list))
+    for (v, u, l) in graph.edges(data="label"):
+        out_edges[v][l].append(u)
+
+    r = set()
+    by_source = defaultdict(lambda: defaultdict(set))
+    by_target = defaultdict(lambda: defaultdict(set))
+    m = []
+
+    demanded = set()
+    demands = []
+
+    def add(v, n, u):
+        if (v, n, u) in r:
+            return
+
+        r.add((v, n, u))
+        by_source[v][n].add(u)
+        by_target[u][n].add(v)
+        m.append((v, n, u))
+
+    def demand(n, v):
+        if (n, v) in demanded:
+            return
+
+        demanded.add((n, v))
+        demands.append((n, v))
+
+    for v in start_nodes:
+        if v in graph:
+            demand(nonterminal, v)
+
+    while len(m) > 0 or len(demands) > 0:
+        if len(demands) > 0:
+            n, v = demands.pop()
+
+            if n in epsilon_heads:
+                add(v, n, v)
+
+            for term in terminals[n]:
+                for u in out_edges[v].get(term, ()):
+                    add(v, n, u)
+
+            for b, c in bodies[n]:
+                demand(b, v)
+
+                for w in list(by_source[v].get(b, ())):
+                    demand(c, w)
+
+                    for u in list(by_source[w].get(c, ())):
+                        add(v, n, u)
+
+            continue
+
+        v, ni, u = m.pop()
+
+        for nk, nj in heads_by_left[ni]:
+            if (nk, v) in demanded:
+                demand(nj, u)
 
-                m.append((v, nk, v1))
-                new_r.add((v, nk, v1))
+                for v1 in list(by_source[u].get(nj, ())):
+                    add(v, nk, v1)
 
-        r |= new_r
+        for nk, nj in heads_by_right[ni]:
+            for v1 in list(by_target[v].get(nj, ())):
+                if (nk, v1) in demanded:
+                    add(v1, nk, u)
 
     return r
 
 
 def cfpq_hellings(
-    graph: MultiDiGraph | str,
+    graph: MultiDiGraph | graphs.CSRGraph | str,
     cfg: CFG | str,
     start_nodes: Iterable[any] = None,
     final_nodes: Iterable[any] = None,
     nonterminal: Variable = None,
-) -> set[tuple[int, int]]:
+    as_arrays: bool = False,
+) -> set[tuple[int, int]] | graphs.NodePairs:
     """
     Context free path querying graph use Hellings' algorithm.
 
     If graph specified by string, it loaded from dataset by name using project.graphs.load_by_name.
     If CFG specified by string, it loaded from text using CFG.from_text.
+    CSRGraph is converted to MultiDiGraph, see project.graphs.to_multidigraph.
+    If `as_arrays` is `True`, returns NodePairs over indices of graph nodes instead of set.
+
+    If `start_nodes` specified, only tuples required for them are derived, see demand_hellings.
     """
 
     if isinstance(graph, str):
         graph = graphs.load_by_name(graph)
 
+    graph = graphs.to_multidigraph(graph)
+
     if isinstance(cfg, str):
         cfg = CFG.from_text(cfg)
 
+    if nonterminal is None:
+        nonterminal = cfg.start_symbol
+
     if start_nodes is None:
         start_nodes = set(graph.nodes)
+        closure = hellings(graph, cfg)
+    else:
+        start_nodes = set(start_nodes)
+        closure = demand_hellings(graph, cfg, start_nodes, nonterminal)
 
     if final_nodes is None:
         final_nodes = set(graph.nodes)
 
-    if nonterminal is None:
-        nonterminal = cfg.start_symbol
-
     result = set()
-    for v, n, u in hellings(graph, cfg):
+    for v, n, u in closure:
         if n == nonterminal and v in start_nodes and u in final_nodes:
             result.add((v, u))
 
+    if as_arrays:
+        return graphs.pairs_to_arrays(result, list(graph.nodes))
+
     return result
 
 
-def matrix_algorithm(
-    graph: MultiDiGraph | str,
+def dependency_order(cfg: CFG) -> list[set[Variable]]:
+    """
+    Returns strongly connected components of dependency graph of nonterminals of grammar
+    in topological order: nonterminals of every component depend only on nonterminals of
+    itself and previous components. Nonterminal depends on nonterminals in bodies of
+    its productions.
+    """
+
+    dependencies = DiGraph()
+    dependencies.add_nodes_from(cfg.variables)
+
+    for p in cfg.productions:
+        for x in p.body:
+            if isinstance(x, Variable):
+                dependencies.add_edge(x, p.head)
+
+    condensed = condensation(dependencies)
+
+    return [set(condensed.nodes[i]["members"]) for i in topological_sort(condensed)]
+
+
+MatrixStats = namedtuple("MatrixStats", ["iterations", "nonzeroes"])
+
+
+def initial_matrices(
+    graph: MultiDiGraph | graphs.CSRGraph,
+    cfg: CFG,
+) -> tuple[graphs.NodeDictionary, dict[Variable, sp.csr_matrix]]:
+    """
+    Returns dictionary of graph nodes and boolean matrix for every nonterminal of grammar
+    in WCNF, built from its terminal and epsilon productions. Matrices are indexed by
+    the dictionary, see graphs.to_csr_graph.
+    """
+
+    graph = graphs.to_csr_graph(graph)
+    nodes = graphs.NodeDictionary(graph.nodes)
+    labels = dict(zip(graph.labels, graph.matrices))
+
+    n = len(nodes)
+    matrices = {nt: sp.csr_matrix((n, n), dtype=np.bool_) for nt in cfg.variables}
+
+    for p in cfg.productions:
+        if len(p.body) == 0:
+            matrices[p.head] += sp.identity(n, dtype=np.bool_, format="csr")
+
+        if len(p.body) == 1 and isinstance(p.body[0], Terminal):
+            label = labels.get(p.body[0].value)
+
+            if label is not None:
+                matrices[p.head] += label
+
+    return nodes, matrices
+
+
+def matrix_closure_with_stats(
+    graph: MultiDiGraph | graphs.CSRGraph | str,
     cfg: CFG | str,
-) -> set[tuple[int, Variable, int]]:
+    semi_naive: bool = True,
+    scheduled: bool = True,
+) -> tuple[dict[Variable, sp.csr_matrix], MatrixStats]:
     """
-    Matrix algorithm got graph and context free grammar and returns a set of tuples
-    (vertex, nonterminal, vertex) so that from second vertex reachable from first by nonterminal.
+    Matrix algorithm got graph and context free grammar and returns boolean matrix for every
+    nonterminal of WCNF of grammar, where element (v, u) is set if vertex u reachable from
+    vertex v by nonterminal. Also returns number of iterations and total number of nonzeroes
+    after every iteration. Vertices are indexed in order of `graph.nodes`, see initial_matrices.
 
-    In other words, it is edges of transitive closure of intersection of given graph and CFG.
+    If `semi_naive` is `True`, every iteration multiplies only matrices of pairs found on
+    previous iteration: B @ C = B_old @ C_old + dB @ C + B @ dC, where first term is already
+    known. Stops when nothing new is found. Otherwise, full products are recomputed on every
+    iteration.
+
+    If `scheduled` is `True` (only with `semi_naive`), nonterminals are processed by groups
+    in order of dependency_order, every group is iterated to its own fixpoint.
 
     If graph specified by string, it loaded from dataset by name using project.graphs.load_by_name.
     If CFG specified by string, it loaded from text using CFG.from_text.
@@ -187,73 +396,315 @@ def matrix_algorithm(
 
     cfg = to_wcnf(cfg)
 
-    n = graph.number_of_nodes()
-    matrices = {nt: sp.dok_matrix((n, n), dtype=np.bool_) for nt in cfg.variables}
+    nodes, matrices = initial_matrices(graph, cfg)
+    n = len(nodes)
+    binary = [p for p in cfg.productions if len(p.body) == 2]
 
-    for p in cfg.productions:
-        matrix = matrices[p.head]
+    if semi_naive and scheduled:
+        groups = dependency_order(cfg)
+    else:
+        groups = [set(cfg.variables)]
 
-        if len(p.body) == 0:
-            for i in range(n):
-                matrix[i, i] = 1
+    nonzeroes = [sum(m.nnz for m in matrices.values())]
 
-        if len(p.body) != 1:
+    for group in groups:
+        productions = [p for p in binary if p.head in group]
+
+        if len(productions) == 0:
             continue
 
-        term = p.body[0]
-        if isinstance(term, Terminal):
-            term = term.value
+        # at first iteration all pairs are new
+        deltas = None
 
-            for (v, u, l) in graph.edges(data="label"):
-                if l == term:
-                    matrix[v, u] = 1
+        while True:
+            new_matrices = {nt: sp.csr_matrix((n, n), dtype=np.bool_) for nt in group}
+
+            for p in productions:
+                b, c = p.body
+
+                if not semi_naive or deltas is None:
+                    new_matrices[p.head] += matrices[b] @ matrices[c]
+                    continue
+
+                if b in deltas and deltas[b].nnz > 0:
+                    new_matrices[p.head] += deltas[b] @ matrices[c]
+
+                if c in deltas and deltas[c].nnz > 0:
+                    new_matrices[p.head] += matrices[b] @ deltas[c]
+
+            deltas = {nt: m > matrices[nt] for nt, m in new_matrices.items()}
+
+            for nt, m in deltas.items():
+                matrices[nt] += m
+
+            nonzeroes.append(sum(m.nnz for m in matrices.values()))
+
+            if all(m.nnz == 0 for m in deltas.values()):
+                break
+
+    return matrices, MatrixStats(iterations=len(nonzeroes) - 1, nonzeroes=nonzeroes)
+
+
+def matrix_closure(
+    graph: MultiDiGraph | graphs.CSRGraph | str,
+    cfg: CFG | str,
+) -> dict[Variable, sp.csr_matrix]:
+    """
+    Returns boolean matrix for every nonterminal of WCNF of grammar,
+    see matrix_closure_with_stats.
+    """
+
+    return matrix_closure_with_stats(graph, cfg)[0]
 
-    matrices = {nt: m.tocsr() for nt, m in matrices.items()}
+
+def masked_matrix_closure_with_stats(
+    graph: MultiDiGraph | graphs.CSRGraph | str,
+    cfg: CFG | str,
+    start_nodes: Iterable[any],
+    nonterminal: Variable = None,
+) -> tuple[dict[Variable, sp.csr_matrix], MatrixStats]:
+    """
+    Source-restricted variant of matrix algorithm: returns boolean matrix for every
+    nonterminal of WCNF of grammar, where only rows of vertices demanded for nonterminal are
+    computed, see demand_hellings. Row of every vertex from `start_nodes` is complete
+    for `nonterminal` (start symbol of grammar by default). Also returns number of iterations
+    and total number of nonzeroes after every iteration, see matrix_closure_with_stats.
+    Vertices are indexed in order of `graph.nodes`, see initial_matrices.
+
+    Demand is propagated eagerly from new rows and new pairs before every iteration.
+    Nonterminals are processed by groups in order of dependency_order, and every iteration
+    multiplies only rows which are new for head of production and pairs which are new
+    since previous iteration of group: A += dB @ C + B @ dC + B[new rows of A] @ C.
+    Groups are repeated while demand for nonterminals of previous groups grows.
+
+    If graph specified by string, it loaded from dataset by name using project.graphs.load_by_name.
+    If CFG specified by string, it loaded from text using CFG.from_text.
+    """
+
+    if isinstance(graph, str):
+        graph = graphs.load_by_name(graph)
+
+    if isinstance(cfg, str):
+        cfg = CFG.from_text(cfg)
+
+    if nonterminal is None:
+        nonterminal = cfg.start_symbol
+
+    cfg = to_wcnf(cfg)
+
+    nodes, terminals = initial_matrices(graph, cfg)
+    n = len(nodes)
+    binary = [p for p in cfg.productions if len(p.body) == 2]
+
+    def empty():
+        return sp.csr_matrix((n, n), dtype=np.bool_)
+
+    def selected(matrix, mask):
+        # mask of stored elements of matrix in rows selected by mask
+        return np.repeat(mask, np.diff(matrix.indptr))
+
+    def rows(matrix, mask):
+        kept = selected(matrix, mask)
+
+        if kept.all():
+            return matrix
+
+        lengths = np.diff(matrix.indptr) * mask
+        indptr = np.concatenate(([0], np.cumsum(lengths)))
+        indices = matrix.indices[kept]
+
+        return sp.csr_matrix(
+            (np.ones(len(indices), dtype=np.bool_), indices, indptr), shape=(n, n)
+        )
+
+    def columns(matrix, mask):
+        result = np.zeros(n, dtype=np.bool_)
+        result[matrix.indices[selected(matrix, mask)]] = True
+
+        return result
+
+    matrices = {nt: empty() for nt in cfg.variables}
+
+    if nonterminal not in matrices:
+        return matrices, MatrixStats(iterations=0, nonzeroes=[0])
+
+    groups = [
+        (group, [p for p in binary if p.head in group])
+        for group in dependency_order(cfg)
+    ]
+    consumers = defaultdict(set)
+    for i, (_, productions) in enumerate(groups):
+        for p in productions:
+            consumers[p.body[0]].add(i)
+            consumers[p.body[1]].add(i)
+
+    # demanded rows for every nonterminal
+    sources = {nt: np.zeros(n, dtype=np.bool_) for nt in cfg.variables}
+    # rows and pairs not yet multiplied by group of nonterminal or by groups using it
+    fresh = {nt: np.zeros(n, dtype=np.bool_) for nt in cfg.variables}
+    pending = [defaultdict(list) for _ in groups]
+    # rows and pairs not yet used to propagate demand
+    new_rows, new_pairs = {}, defaultdict(list)
+
+    def add(nt, pairs):
+        if pairs.nnz == 0:
+            return
+
+        matrices[nt] = matrices[nt] + pairs
+        new_pairs[nt].append(pairs)
+
+        for i in consumers[nt]:
+            pending[i][nt].append(pairs)
+
+    def demand(nt, mask):
+        mask = mask & ~sources[nt]
+
+        if not mask.any():
+            return
+
+        sources[nt] |= mask
+        fresh[nt] |= mask
+        new_rows[nt] = new_rows[nt] | mask if nt in new_rows else mask
+
+        if terminals[nt].nnz > 0:
+            add(nt, rows(terminals[nt], mask))
+
+    def propagate():
+        nonlocal new_rows, new_pairs
+
+        while len(new_rows) > 0 or len(new_pairs) > 0:
+            demanded, found = new_rows, new_pairs
+            new_rows, new_pairs = {}, defaultdict(list)
+
+            for p in binary:
+                a, (b, c) = p.head, p.body
+
+                if a in demanded:
+                    demand(b, demanded[a])
+                    demand(c, columns(matrices[b], demanded[a]))
+
+                for pairs in found.get(b, []):
+                    demand(c, columns(pairs, sources[a]))
+
+    start = np.zeros(n, dtype=np.bool_)
+    start[nodes.encode_known(start_nodes)] = True
+    demand(nonterminal, start)
+    propagate()
+
+    nonzeroes = [sum(m.nnz for m in matrices.values())]
 
     while True:
-        new_matrices = {
-            nt: sp.csr_matrix((n, n), dtype=np.bool_) for nt in cfg.variables
-        }
+        progressed = False
 
-        for p in cfg.productions:
-            if len(p.body) != 2:
+        for i, (group, productions) in enumerate(groups):
+            if len(productions) == 0:
                 continue
 
-            new_matrices[p.head] += matrices[p.body[0]] @ matrices[p.body[1]]
+            while True:
+                propagate()
+
+                deltas = {nt: sum(m[1:], m[0]) for nt, m in pending[i].items()}
+                pending[i] = defaultdict(list)
+                new_sources = {a: fresh[a] for a in group if fresh[a].any()}
+
+                if len(deltas) == 0 and len(new_sources) == 0:
+                    break
 
-        old_nonzeroes = {nt: m.count_nonzero() for nt, m in matrices.items()}
+                for a in new_sources:
+                    fresh[a] = np.zeros(n, dtype=np.bool_)
 
-        for nt, m in new_matrices.items():
-            matrices[nt] += m
+                products = defaultdict(list)
 
-        new_nonzeroes = {nt: m.count_nonzero() for nt, m in matrices.items()}
+                for p in productions:
+                    a, (b, c) = p.head, p.body
+                    terms = []
 
-        if old_nonzeroes == new_nonzeroes:
+                    if b in deltas:
+                        terms.append((rows(deltas[b], sources[a]), matrices[c]))
+
+                    if c in deltas:
+                        terms.append((rows(matrices[b], sources[a]), deltas[c]))
+
+                    if a in new_sources:
+                        terms.append((rows(matrices[b], new_sources[a]), matrices[c]))
+
+                    for left, right in terms:
+                        if left.nnz > 0 and right.nnz > 0:
+                            products[a].append(left @ right)
+
+                for a, parts in products.items():
+                    add(a, sum(parts[1:], parts[0]) > matrices[a])
+
+                nonzeroes.append(sum(m.nnz for m in matrices.values()))
+                progressed = True
+
+        if not progressed:
             break
 
+    return matrices, MatrixStats(iterations=len(nonzeroes) - 1, nonzeroes=nonzeroes)
+
+
+def masked_matrix_closure(
+    graph: MultiDiGraph | graphs.CSRGraph | str,
+    cfg: CFG | str,
+    start_nodes: Iterable[any],
+    nonterminal: Variable = None,
+) -> dict[Variable, sp.csr_matrix]:
+    """
+    Returns boolean matrix for every nonterminal of WCNF of grammar, where only rows
+    demanded for `start_nodes` are computed, see masked_matrix_closure_with_stats.
+    """
+
+    return masked_matrix_closure_with_stats(graph, cfg, start_nodes, nonterminal)[0]
+
+
+def matrix_algorithm(
+    graph: MultiDiGraph | graphs.CSRGraph | str,
+    cfg: CFG | str,
+) -> set[tuple[any, Variable, any]]:
+    """
+    Matrix algorithm got graph and context free grammar and returns a set of tuples
+    (vertex, nonterminal, vertex) so that from second vertex reachable from first by nonterminal.
+
+    In other words, it is edges of transitive closure of intersection of given graph and CFG.
+
+    If graph specified by string, it loaded from dataset by name using project.graphs.load_by_name.
+    If CFG specified by string, it loaded from text using CFG.from_text.
+    """
+
+    if isinstance(graph, str):
+        graph = graphs.load_by_name(graph)
+
+    graph = graphs.to_csr_graph(graph)
+
     result = set()
-    for nt, m in matrices.items():
+    for nt, m in matrix_closure(graph, cfg).items():
         m = m.tocoo()
+        m.eliminate_zeros()
 
-        for i, j, v in zip(m.row, m.col, m.data):
-            if v:
-                result.add((i, nt, j))
+        sources, targets = graph.nodes[m.row], graph.nodes[m.col]
+        result.update((v, nt, u) for v, u in zip(sources.tolist(), targets.tolist()))
 
     return result
 
 
 def cfpq_matrix(
-    graph: MultiDiGraph | str,
+    graph: MultiDiGraph | graphs.CSRGraph | str,
     cfg: CFG | str,
     start_nodes: Iterable[any] = None,
     final_nodes: Iterable[any] = None,
     nonterminal: Variable = None,
-) -> set[tuple[int, int]]:
+    as_arrays: bool = False,
+) -> set[tuple[int, int]] | graphs.NodePairs:
     """
     Context free path querying graph use matrix algorithm.
 
     If graph specified by string, it loaded from dataset by name using project.graphs.load_by_name.
     If CFG specified by string, it loaded from text using CFG.from_text.
+    If `as_arrays` is `True`, returns NodePairs over indices of graph nodes instead of set.
+
+    If `start_nodes` specified, only rows required for them are computed,
+    see masked_matrix_closure.
     """
 
     if isinstance(graph, str):
@@ -262,18 +713,113 @@ def cfpq_matrix(
     if isinstance(cfg, str):
         cfg = CFG.from_text(cfg)
 
+    if nonterminal is None:
+        nonterminal = cfg.start_symbol
+
+    graph = graphs.to_csr_graph(graph)
+    nodes = graphs.NodeDictionary(graph.nodes)
+
     if start_nodes is None:
-        start_nodes = set(graph.nodes)
+        closure = matrix_closure(graph, cfg)
+    else:
+        start_nodes = list(start_nodes)
+        closure = masked_matrix_closure(graph, cfg, start_nodes, nonterminal)
+
+    n = len(nodes)
+
+    def nodes_indices(selected):
+        if selected is None:
+            return np.arange(n)
+
+        return nodes.encode_known(selected)
+
+    start_nodes, final_nodes = nodes_indices(start_nodes), nodes_indices(final_nodes)
+
+    result = sp.csr_matrix((n, n), dtype=np.bool_)
+    for nt, m in closure.items():
+        if nt == nonterminal:
+            result += m
+
+    result = result[start_nodes][:, final_nodes].tocoo()
+    result.eliminate_zeros()
+
+    sources, targets = start_nodes[result.row], final_nodes[result.col]
+
+    if as_arrays:
+        return graphs.NodePairs(
+            sources=sources.astype(np.int32),
+            targets=targets.astype(np.int32),
+            nodes=nodes.nodes,
+        )
+
+    return set(zip(nodes.decode(sources).tolist(), nodes.decode(targets).tolist()))
 
-    if final_nodes is None:
-        final_nodes = set(graph.nodes)
+
+def cfpq_tensor(
+    graph: MultiDiGraph | graphs.CSRGraph | str,
+    cfg: CFG | ECFG | str,
+    start_nodes: Iterable[any] = None,
+    final_nodes: Iterable[any] = None,
+    nonterminal: Variable = None,
+    as_arrays: bool = False,
+) -> set[tuple[int, int]] | graphs.NodePairs:
+    """
+    Context free path querying graph use tensor algorithm, see rfa.intersect_with_fa.
+    Grammar is converted to RFA without transforming it to WCNF.
+
+    If graph specified by string, it loaded from dataset by name using project.graphs.load_by_name.
+    If CFG specified by string, it loaded from text using CFG.from_text.
+    If `as_arrays` is `True`, returns NodePairs over indices of graph nodes instead of set.
+    """
+
+    if isinstance(graph, str):
+        graph = graphs.load_by_name(graph)
+
+    if isinstance(cfg, str):
+        cfg = CFG.from_text(cfg)
+
+    if isinstance(cfg, CFG):
+        cfg = ECFG.from_cfg(cfg)
 
     if nonterminal is None:
         nonterminal = cfg.start_symbol
 
-    result = set()
-    for v, n, u in matrix_algorithm(graph, cfg):
-        if n == nonterminal and v in start_nodes and u in final_nodes:
-            result.add((v, u))
+    rfa = cfg.to_rfa().minimize()
 
-    return result
+    graph = graphs.to_csr_graph(graph)
+    nodes = graphs.NodeDictionary(graph.nodes)
+
+    if Nonterminal(nonterminal) not in rfa.fas:
+        result = graphs.NodePairs(
+            sources=np.array([], dtype=np.int32),
+            targets=np.array([], dtype=np.int32),
+            nodes=nodes.nodes,
+        )
+
+        return result if as_arrays else set()
+
+    rfa = RFA(Nonterminal(nonterminal), rfa.fas)
+    intersection = intersect_with_fa(rfa, graph_to_boolean_fa(graph))
+
+    def nodes_mask(selected):
+        result = np.zeros(len(nodes), dtype=np.bool_)
+
+        if selected is None:
+            result[:] = True
+        else:
+            result[nodes.encode_known(selected)] = True
+
+        return result
+
+    start_mask, final_mask = nodes_mask(start_nodes), nodes_mask(final_nodes)
+
+    result = intersection.matrices[0].tocoo()
+    selected = result.data & start_mask[result.row] & final_mask[result.col]
+
+    sources = result.row[selected].astype(np.int32)
+    targets = result.col[selected].astype(np.int32)
+
+    if as_arrays:
+        return graphs.NodePairs(sources=sources, targets=targets, nodes=nodes.nodes)
+
+    return set(zip(nodes.decode(sources).tolist(), nodes.decode(targets).tolist()))
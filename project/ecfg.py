@@ -3,8 +3,13 @@ from __future__ import annotations
 from pyformlang.finite_automaton import EpsilonNFA, Symbol
 from pyformlang.regular_expression import Regex
 from project.fa import iterate_transitions
-from project.rfa import RFA, Nonterminal
+from project.rfa import RFA, RFA_FORMAT_VERSION, Nonterminal, load_rfa, save_rfa
 from collections import defaultdict
+import tempfile
+import hashlib
+import zipfile
+import json
+import os
 
 
 class ECFG:
@@ -117,7 +122,63 @@ class ECFG:
             for x in prod.body:
                 terms.append(f"{escape_regex(x.value)}")
 
+            # empty body is epsilon, "$" in syntax of pyformlang
+            if len(terms) == 0:
+                terms.append("$")
+
             rules[prod.head].append(" ".join(terms))
 
         rules = {nt: Regex(" | ".join(terms)) for nt, terms in rules.items()}
         return ECFG(cfg.start_symbol, rules)
+
+
+# directory of compiled RFAs used by compile_rfa, if no other specified
+RFA_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "project", "rfa")
+
+
+def compile_rfa(
+    text: str,
+    start_symbol: str = None,
+    cache_dir: str = None,
+) -> RFA:
+    """
+    Returns minimal RFA of ECFG parsed from text by ECFG.from_text.
+
+    Compiled RFA is saved by save_rfa to cache directory (RFA_CACHE_DIR by default) with
+    name by hash of text and start symbol, so next calls with the same grammar only load it.
+    """
+
+    if cache_dir is None:
+        cache_dir = RFA_CACHE_DIR
+
+    key = json.dumps([RFA_FORMAT_VERSION, start_symbol, text])
+    key = hashlib.sha256(key.encode()).hexdigest()
+    path = os.path.join(cache_dir, f"{key}.npz")
+
+    try:
+        return load_rfa(path)
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+        pass
+
+    rfa = ECFG.from_text(text, start_symbol).to_rfa().minimize()
+
+    # write to temporary file first, so concurrent readers never see partial file;
+    # if cache directory isn't writable, compiled RFA is returned without caching
+    f = None
+
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+            dir=cache_dir, suffix=".tmp", delete=False
+        ) as f:
+            save_rfa(rfa, f)
+
+        os.replace(f.name, path)
+    except OSError:
+        if f is not None:
+            try:
+                os.remove(f.name)
+            except OSError:
+                pass
+
+    return rfa
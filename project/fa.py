@@ -1,15 +1,20 @@
+from __future__ import annotations
+
 from pyformlang.finite_automaton import (
     FiniteAutomaton,
     DeterministicFiniteAutomaton,
     EpsilonNFA,
+    Epsilon,
     Symbol,
     State,
 )
 from networkx.classes.multidigraph import MultiDiGraph
 from pyformlang.regular_expression import Regex
-from project.graphs import summary
-from math import log2, ceil
-from typing import Iterable
+from project.graphs import CSRGraph, NodeDictionary, NodePairs, summary, to_csr_graph
+from collections.abc import Sequence
+from collections import namedtuple
+from typing import Iterable, Iterator
+from scipy.sparse import csgraph
 import scipy.sparse as sp
 import numpy as np
 
@@ -95,19 +100,70 @@ def to_boolean_matrix(
     return sp.coo_matrix(result)
 
 
+def boolean_matrices_from_edges(
+    n_states: int,
+    labels: list[any],
+    rows: Iterable[int],
+    cols: Iterable[int],
+    label_ids: Iterable[int],
+) -> dict[any, sp.csr_matrix]:
+    """
+    Builds boolean adjacency matrices for every label from edges given as index arrays.
+    Edge k goes from state rows[k] to state cols[k] by label labels[label_ids[k]].
+    """
+
+    rows = np.asarray(rows, dtype=np.int64)
+    cols = np.asarray(cols, dtype=np.int64)
+    label_ids = np.asarray(label_ids, dtype=np.int64)
+
+    order = np.argsort(label_ids, kind="stable")
+    bounds = np.searchsorted(label_ids[order], np.arange(len(labels) + 1))
+
+    result = {}
+    for k, label in enumerate(labels):
+        edges = order[bounds[k] : bounds[k + 1]]
+
+        result[label] = sp.csr_matrix(
+            (np.ones(len(edges), dtype=np.bool_), (rows[edges], cols[edges])),
+            shape=(n_states, n_states),
+        )
+
+    return result
+
+
 def to_boolean_matrices(
     fa: EpsilonNFA,
     mapping: dict[Symbol, int],
-) -> dict[any, sp.coo_matrix]:
+) -> dict[any, sp.csr_matrix]:
     """
     Builds set boolean adjacency matrices of FA for every label.
+    Transitions are walked only once for all labels.
     """
 
-    return {s: to_boolean_matrix(fa, s, mapping) for s in fa.symbols}
+    n_states = len(fa.states)
+
+    if n_states != len(mapping):
+        raise ValueError("mapping isn't complete")
+
+    labels = list(fa.symbols)
+    labels_mapping = {s: i for i, s in enumerate(labels)}
+
+    rows, cols, label_ids = [], [], []
+    for u, s, v in iterate_transitions(fa):
+        k = labels_mapping.get(s)
+
+        if k is None:
+            continue
+
+        rows.append(mapping[u])
+        cols.append(mapping[v])
+        label_ids.append(k)
+
+    return boolean_matrices_from_edges(n_states, labels, rows, cols, label_ids)
 
 
 def from_boolean_matrices(
-    boolean: dict[any, sp.coo_matrix],
+    boolean: dict[any, sp.spmatrix],
     states: list[any] = None,
 ) -> EpsilonNFA:
     """
@@ -118,6 +174,8 @@ def from_boolean_matrices(
     result = EpsilonNFA()
 
     for label, b in boolean.items():
+        b = sp.coo_matrix(b)
+
         for i, j, v in zip(b.row, b.col, b.data):
             if v:
                 si, sj = (states[i], states[j]) if states is not None else (i, j)
@@ -144,193 +202,876 @@ def adjacency_matrix(fa: EpsilonNFA, mapping: dict[any, int]) -> sp.coo_matrix:
     return sp.coo_matrix(result)
 
 
-def intersect(a: EpsilonNFA, b: EpsilonNFA) -> EpsilonNFA:
+class BooleanFA:
     """
-    Intersects two FAs by kronecker product.
-    States of result FA is pairs of states of specified FAs.
+    Finite automaton represented by boolean adjacency matrices.
+
+    States and labels are numbered densely from zero: `states` and `labels` map indices to
+    original values, `matrices` contains CSR adjacency matrix for every label index.
+    Start and final states are stored as boolean masks over state indices.
+    Epsilon transitions are kept under the `Epsilon` label.
+    States are encoded to indices by NodeDictionary, which is given or built on first use.
     """
 
-    a_mapping, b_mapping = states_mapping(a), states_mapping(b)
+    def __init__(
+        self,
+        states: Sequence[any],
+        labels: list[any],
+        matrices: list[sp.csr_matrix],
+        start_states: np.ndarray,
+        final_states: np.ndarray,
+        states_dictionary: NodeDictionary = None,
+    ):
+        self.states = states
+        self.labels = labels
+        self.matrices = matrices
+        self.start_states = np.asarray(start_states, dtype=np.bool_)
+        self.final_states = np.asarray(final_states, dtype=np.bool_)
+        self.labels_mapping = {l: i for i, l in enumerate(labels)}
+        self._states_dictionary = states_dictionary
+
+    @property
+    def states_amount(self) -> int:
+        return len(self.start_states)
+
+    def states_dictionary(self) -> NodeDictionary:
+        """
+        Returns NodeDictionary of FA states.
+        """
+
+        if self._states_dictionary is None:
+            self._states_dictionary = NodeDictionary(self.states)
+
+        return self._states_dictionary
+
+    def states_mapping(self) -> dict[any, int]:
+        """
+        Returns dict with FA states names to indices.
+        """
+
+        return {s: i for i, s in enumerate(self.states)}
+
+    def decode_states(self, indices: np.ndarray) -> list[any]:
+        """
+        Returns list of FA states by indices.
+        """
+
+        indices = np.asarray(indices, dtype=np.int64)
+        return self.states_dictionary().decode(indices).tolist()
+
+    def boolean_matrices(self) -> dict[any, sp.csr_matrix]:
+        """
+        Returns dict of label to boolean adjacency matrix.
+        """
+
+        return dict(zip(self.labels, self.matrices))
+
+    def adjacency_matrix(self) -> sp.csr_matrix:
+        """
+        Builds adjacency matrix of FA for all labels.
+        """
+
+        n = self.states_amount
+        result = sp.csr_matrix((n, n), dtype=np.bool_)
+
+        for m in self.matrices:
+            result += m
+
+        return result
+
+    def to_nfa(self) -> EpsilonNFA:
+        """
+        Converts FA to pyformlang's EpsilonNFA.
+        """
+
+        states = self.states
+        if isinstance(states, np.ndarray):
+            states = states.tolist()
+
+        result = EpsilonNFA(
+            states=set(states),
+            input_symbols={l for l in self.labels if not isinstance(l, Epsilon)},
+            start_state={states[i] for i in np.flatnonzero(self.start_states)},
+            final_states={states[i] for i in np.flatnonzero(self.final_states)},
+        )
+
+        for label, m in zip(self.labels, self.matrices):
+            m = m.tocoo()
+
+            result.add_transitions(
+                [(states[i], label, states[j]) for i, j in zip(m.row, m.col)]
+            )
 
-    a_boolean = to_boolean_matrices(a, a_mapping)
-    b_boolean = to_boolean_matrices(b, b_mapping)
+        return result
 
-    same_labels = set.intersection(set(a_boolean.keys()), set(b_boolean.keys()))
-    result_boolean = {
-        l: sp.coo_matrix(sp.kron(a_boolean[l], b_boolean[l])) for l in same_labels
-    }
+    @staticmethod
+    def from_nfa(fa: EpsilonNFA) -> BooleanFA:
+        """
+        Converts pyformlang's FA to BooleanFA.
+        """
 
-    result_states = [None for i in range(len(a_mapping) * len(b_mapping))]
-    for a_st, i in a_mapping.items():
-        for b_st, j in b_mapping.items():
-            result_states[i * len(b_mapping) + j] = (a_st.value, b_st.value)
+        mapping = states_mapping(fa)
+        states = [s.value for s in mapping.keys()]
 
-    result = from_boolean_matrices(result_boolean, result_states)
+        labels = list(fa.symbols)
+        labels_mapping = {s: i for i, s in enumerate(labels)}
 
-    for a_state in a.start_states:
-        for b_state in b.start_states:
-            result.add_start_state(
-                result_states[a_mapping[a_state] * len(b_mapping) + b_mapping[b_state]]
-            )
+        rows, cols, label_ids = [], [], []
+        for u, s, v in iterate_transitions(fa):
+            k = labels_mapping.get(s)
+
+            if k is None:
+                k = labels_mapping[s] = len(labels)
+                labels.append(s)
+
+            rows.append(mapping[u])
+            cols.append(mapping[v])
+            label_ids.append(k)
+
+        matrices = boolean_matrices_from_edges(
+            len(states), labels, rows, cols, label_ids
+        )
+
+        start_states = np.zeros(len(states), dtype=np.bool_)
+        start_states[[mapping[s] for s in fa.start_states]] = True
+
+        final_states = np.zeros(len(states), dtype=np.bool_)
+        final_states[[mapping[s] for s in fa.final_states]] = True
+
+        return BooleanFA(
+            states,
+            labels,
+            [matrices[l] for l in labels],
+            start_states,
+            final_states,
+        )
+
+
+def as_boolean_fa(fa: EpsilonNFA | BooleanFA) -> BooleanFA:
+    """
+    Returns FA as BooleanFA, converting it if needed.
+    """
+
+    if isinstance(fa, BooleanFA):
+        return fa
+
+    return BooleanFA.from_nfa(fa)
+
+
+def graph_to_boolean_fa(
+    graph: MultiDiGraph | CSRGraph,
+    start_states: Iterable[any] = None,
+    final_states: Iterable[any] = None,
+) -> BooleanFA:
+    """
+    Builds BooleanFA from multi-digraph without building pyformlang's FA, states are
+    indexed by NodeDictionary of graph (see graphs.to_csr_graph).
+    CSRGraph (see graphs.load_csr_from_file) is used without copying its matrices.
+    If start states and/or final states aren't specified, all states will be start/final.
+    """
+
+    graph = to_csr_graph(graph)
+    nodes = NodeDictionary(graph.nodes)
+
+    def states_mask(selected):
+        if selected is None:
+            return np.ones(len(nodes), dtype=np.bool_)
+
+        result = np.zeros(len(nodes), dtype=np.bool_)
+        result[nodes.encode_known(selected)] = True
+        return result
+
+    return BooleanFA(
+        graph.nodes,
+        graph.labels,
+        graph.matrices,
+        states_mask(start_states),
+        states_mask(final_states),
+        nodes,
+    )
+
+
+class ProductStates(Sequence):
+    """
+    Lazy sequence of pairs of states of intersected FAs.
+
+    Pair of states with indices i and j is encoded as `i * len(b_states) + j`.
+    If codes are specified, sequence contains only pairs with these codes in given order,
+    otherwise it contains all pairs.
+    """
+
+    def __init__(
+        self,
+        a_states: Sequence[any],
+        b_states: Sequence[any],
+        codes: np.ndarray = None,
+    ):
+        self.a_states = a_states
+        self.b_states = b_states
+        self.codes = codes
+
+    def __len__(self) -> int:
+        if self.codes is not None:
+            return len(self.codes)
+
+        return len(self.a_states) * len(self.b_states)
+
+    def __getitem__(self, k: int) -> tuple[any, any]:
+        if not 0 <= k < len(self):
+            raise IndexError("product state index out of range")
+
+        code = self.codes[k] if self.codes is not None else k
+        i, j = divmod(int(code), len(self.b_states))
+
+        return self.a_states[i], self.b_states[j]
+
+    def __iter__(self) -> Iterable[tuple[any, any]]:
+        for k in range(len(self)):
+            yield self[k]
+
+
+def shared_labels(a: BooleanFA, b: BooleanFA) -> list[any]:
+    """
+    Returns labels of both FAs, except epsilon.
+    """
 
-    for a_state in a.final_states:
-        for b_state in b.final_states:
-            result.add_final_state(
-                result_states[a_mapping[a_state] * len(b_mapping) + b_mapping[b_state]]
+    return [l for l in a.labels if l in b.labels_mapping and not isinstance(l, Epsilon)]
+
+
+def reachable_product_codes(a: BooleanFA, b: BooleanFA) -> np.ndarray:
+    """
+    Returns sorted codes of pairs of states of product of FAs (see ProductStates),
+    that reachable from pairs of start states.
+
+    Product is explored by fronts, one matrix product per label, without building
+    kronecker product.
+    """
+
+    n, m = a.states_amount, b.states_amount
+
+    labels = [
+        (
+            a.matrices[a.labels_mapping[l]].transpose().tocsr(),
+            b.matrices[b.labels_mapping[l]],
+        )
+        for l in shared_labels(a, b)
+    ]
+
+    a_start, b_start = np.flatnonzero(a.start_states), np.flatnonzero(b.start_states)
+
+    front = sp.csr_matrix(
+        (
+            np.ones(len(a_start) * len(b_start), dtype=np.bool_),
+            (np.repeat(a_start, len(b_start)), np.tile(b_start, len(a_start))),
+        ),
+        shape=(n, m),
+    )
+
+    visited = front
+    while front.nnz > 0:
+        next_front = sp.csr_matrix((n, m), dtype=np.bool_)
+
+        for a_mat, b_mat in labels:
+            next_front += a_mat @ front @ b_mat
+
+        front = next_front > visited
+        visited = visited + front
+
+    visited = visited.tocoo()
+    return np.sort(visited.row.astype(np.int64) * m + visited.col)
+
+
+def intersect_boolean(
+    a: BooleanFA,
+    b: BooleanFA,
+    reachable_only: bool = False,
+) -> BooleanFA:
+    """
+    Intersects two BooleanFAs by kronecker product.
+    States of result FA is pairs of states of specified FAs, see ProductStates.
+
+    If `reachable_only` is `True`, only states reachable from start states are built,
+    transitions of `a` are iterated in Python, so it is expected to be the smaller FA.
+    """
+
+    labels = shared_labels(a, b)
+
+    if not reachable_only:
+        return BooleanFA(
+            ProductStates(a.states, b.states),
+            labels,
+            [
+                sp.kron(
+                    a.matrices[a.labels_mapping[l]],
+                    b.matrices[b.labels_mapping[l]],
+                    format="csr",
+                )
+                for l in labels
+            ],
+            np.outer(a.start_states, b.start_states).ravel(),
+            np.outer(a.final_states, b.final_states).ravel(),
+        )
+
+    m = b.states_amount
+    codes = reachable_product_codes(a, b)
+    bounds = np.searchsorted(codes // m, np.arange(a.states_amount + 1))
+
+    matrices = []
+    for l in labels:
+        a_mat = a.matrices[a.labels_mapping[l]].tocoo()
+        b_mat = b.matrices[b.labels_mapping[l]]
+
+        rows, cols = [np.empty(0, dtype=np.int64)], [np.empty(0, dtype=np.int64)]
+        for i, j in zip(a_mat.row, a_mat.col):
+            sources = np.arange(bounds[i], bounds[i + 1])
+            targets = b_mat[codes[sources] % m].tocoo()
+
+            rows.append(sources[targets.row])
+            cols.append(np.searchsorted(codes, j * m + targets.col))
+
+        rows, cols = np.concatenate(rows), np.concatenate(cols)
+
+        matrices.append(
+            sp.csr_matrix(
+                (np.ones(len(rows), dtype=np.bool_), (rows, cols)),
+                shape=(len(codes), len(codes)),
             )
+        )
+
+    return BooleanFA(
+        ProductStates(a.states, b.states, codes),
+        labels,
+        matrices,
+        a.start_states[codes // m] & b.start_states[codes % m],
+        a.final_states[codes // m] & b.final_states[codes % m],
+    )
+
+
+def intersect(
+    a: EpsilonNFA | BooleanFA,
+    b: EpsilonNFA | BooleanFA,
+    reachable_only: bool = False,
+) -> EpsilonNFA | BooleanFA:
+    """
+    Intersects two FAs by kronecker product.
+    States of result FA is pairs of states of specified FAs.
+
+    If any of FAs is BooleanFA, result is BooleanFA too.
+    If `reachable_only` is `True`, only states reachable from start states are built.
+    """
+
+    if isinstance(a, BooleanFA) or isinstance(b, BooleanFA):
+        return intersect_boolean(as_boolean_fa(a), as_boolean_fa(b), reachable_only)
+
+    c = intersect_boolean(BooleanFA.from_nfa(a), BooleanFA.from_nfa(b), reachable_only)
+    result = from_boolean_matrices(c.boolean_matrices(), c.states)
+
+    for i in np.flatnonzero(c.start_states):
+        result.add_start_state(c.states[i])
+
+    for i in np.flatnonzero(c.final_states):
+        result.add_final_state(c.states[i])
 
     return result
 
 
-def transitive_closure(mat: sp.spmatrix) -> sp.csr_matrix:
+ClosureStats = namedtuple("ClosureStats", ["rounds", "nonzeroes"])
+
+
+def transitive_closure_with_stats(
+    mat: sp.spmatrix,
+) -> tuple[sp.csr_matrix, ClosureStats]:
     """
-    Returns reflexive-transitive closure of adjacency matrix.
+    Returns transitive closure of adjacency matrix and statistics of its computation:
+    number of rounds and number of nonzeroes before first round and after every round.
+
+    Each round squares the closure, but only paths through pairs discovered in the previous
+    round are multiplied: C @ C = C_old @ C_old + D @ C + C_old @ D, where C = C_old + D
+    and first term is already in the closure. Stops as soon as no new pairs are discovered.
     """
 
-    closure = sp.csr_matrix(mat)
+    closure = sp.csr_matrix(mat, dtype=np.bool_)
+    closure.eliminate_zeros()
+
+    # at first round all pairs are new
+    old = sp.csr_matrix(closure.shape, dtype=np.bool_)
+    delta = closure
+    nonzeroes = [closure.nnz]
+
+    while delta.nnz > 0:
+        new = delta @ closure + old @ delta
 
-    for _ in range(ceil(log2(mat.get_shape()[0]))):
-        closure += closure @ closure
+        old = closure
+        delta = new > closure
+        closure = closure + delta
+        nonzeroes.append(closure.nnz)
 
-    return closure
+    return closure, ClosureStats(rounds=len(nonzeroes) - 1, nonzeroes=nonzeroes)
 
 
-def reachable_states(c: EpsilonNFA) -> set[tuple[any, any]]:
+def condensation(mat: sp.spmatrix) -> tuple[np.ndarray, sp.csr_matrix, np.ndarray]:
     """
-    Returns set of pairs of states. Each pair is one of start states and one of final states and
-    means that second state reachable from first state.
+    Collapses strongly connected components of graph with specified adjacency matrix.
+
+    Returns component index of every state, adjacency matrix of condensation DAG and mask of
+    components which states reachable from themselves (components with cycles).
     """
 
-    c_mapping = states_mapping(c)
-    c_matrix = adjacency_matrix(c, c_mapping)
+    mat = sp.csr_matrix(mat, dtype=np.bool_)
+    mat.eliminate_zeros()
+
+    k, components = csgraph.connected_components(
+        mat,
+        directed=True,
+        connection="strong",
+    )
 
-    start_states = {i: s.value for s, i in c_mapping.items() if s in c.start_states}
-    final_states = {i: s.value for s, i in c_mapping.items() if s in c.final_states}
-    c_closure = sp.coo_matrix(transitive_closure(c_matrix))
+    mat = mat.tocoo()
+    u, v = components[mat.row], components[mat.col]
+    inner = u == v
 
-    result = set()
-    for i, j, v in zip(c_closure.row, c_closure.col, c_closure.data):
-        if v and i in start_states and j in final_states:
-            result.add((start_states[i], final_states[j]))
+    cyclic = np.bincount(components, minlength=k) > 1
+    cyclic[u[inner]] = True
 
-    return result
+    dag = sp.csr_matrix(
+        (np.ones(np.count_nonzero(~inner), dtype=np.bool_), (u[~inner], v[~inner])),
+        shape=(k, k),
+    )
+
+    return components, dag, cyclic
+
+
+def condensation_closure(dag: sp.csr_matrix, cyclic: np.ndarray) -> sp.csr_matrix:
+    """
+    Returns transitive closure of condensation DAG, see condensation.
+
+    Components are processed in reverse topological order by levels: reachability of
+    component is union of its successors and their reachability. Components are renumbered
+    in order of processing, so rows of every level are appended after rows of previous
+    levels to growing buffers of CSR matrix instead of rebuilding whole closure.
+    """
+
+    k = dag.shape[0]
+    predecessors = dag.transpose().tocsr()
+
+    levels = []
+    remaining = np.diff(dag.indptr)
+
+    current = np.flatnonzero(remaining == 0)
+    while len(current) > 0:
+        levels.append(current)
+
+        remaining = remaining - np.bincount(
+            predecessors[current].indices,
+            minlength=k,
+        )
+        remaining[current] = -1
+
+        current = np.flatnonzero(remaining == 0)
+
+    order = np.concatenate([np.empty(0, dtype=np.int64), *levels])
+    positions = np.empty(k, dtype=np.int64)
+    positions[order] = np.arange(k)
+
+    # successors of every component are processed before it
+    dag = dag[order][:, order].tocsr()
+
+    indptr = np.zeros(k + 1, dtype=np.int64)
+    indices = np.empty(max(dag.nnz, 1), dtype=np.int64)
+    nnz = 0
+
+    start = 0
+    for level in levels:
+        end = start + len(level)
+
+        # row of component is union of its successors and their rows gathered from buffers
+        block = dag[start:end]
+        sources = np.repeat(np.arange(len(level)), np.diff(block.indptr))
+        successors = block.indices
+
+        starts = indptr[successors]
+        lengths = indptr[successors + 1] - starts
+        gathered = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        gathered = indices[gathered + np.arange(lengths.sum())]
+
+        rows = sp.csr_matrix(
+            (
+                np.ones(len(successors) + len(gathered), dtype=np.bool_),
+                (
+                    np.concatenate([sources, np.repeat(sources, lengths)]),
+                    np.concatenate([successors, gathered]),
+                ),
+            ),
+            shape=(len(level), k),
+        )
+        rows.sum_duplicates()
+
+        if nnz + rows.nnz > len(indices):
+            indices = np.resize(indices, max(2 * len(indices), nnz + rows.nnz))
+
+        indices[nnz : nnz + rows.nnz] = rows.indices
+        indptr[start + 1 : end + 1] = nnz + rows.indptr[1:]
+        nnz += rows.nnz
+        indptr[end + 1 :] = nnz
+
+        start = end
+
+    closure = sp.csr_matrix(
+        (np.ones(nnz, dtype=np.bool_), indices[:nnz], indptr),
+        shape=(k, k),
+    )
+    closure = closure[positions][:, positions]
+
+    return closure + sp.diags(cyclic, format="csr", dtype=np.bool_)
+
+
+def condensed_reachability(
+    mat: sp.spmatrix,
+    sources: Iterable[int] = None,
+    targets: Iterable[int] = None,
+) -> sp.csr_matrix:
+    """
+    Returns transitive closure of adjacency matrix restricted to specified source rows and
+    target columns (all states if not specified).
+
+    Closure is computed for condensation DAG only and expanded to states just for
+    requested sources and targets.
+    """
+
+    n = mat.shape[0]
+
+    sources = np.arange(n) if sources is None else np.asarray(sources, dtype=np.int64)
+    targets = np.arange(n) if targets is None else np.asarray(targets, dtype=np.int64)
+
+    if n == 0:
+        return sp.csr_matrix((len(sources), len(targets)), dtype=np.bool_)
+
+    components, dag, cyclic = condensation(mat)
+    closure = condensation_closure(dag, cyclic)
+
+    return closure[components[sources]][:, components[targets]]
+
+
+def transitive_closure(mat: sp.spmatrix, algorithm: str = "squaring") -> sp.csr_matrix:
+    """
+    Returns transitive closure of adjacency matrix.
+
+    Algorithm could be one of:
+        - "squaring": semi-naive squaring, see transitive_closure_with_stats,
+        - "scc": closure of condensation DAG, see condensed_reachability.
+    """
+
+    if algorithm == "squaring":
+        return transitive_closure_with_stats(mat)[0]
+
+    if algorithm == "scc":
+        return condensed_reachability(mat)
+
+    raise ValueError(f"unknown algorithm: {algorithm}")
+
+
+def multi_source_reachability(
+    mat: sp.spmatrix, sources: Iterable[int]
+) -> sp.csr_matrix:
+    """
+    Returns rows of transitive closure of adjacency matrix for specified sources only.
+    Fronts of all sources are advanced together, one matrix product per step.
+    """
+
+    mat = sp.csr_matrix(mat, dtype=np.bool_)
+    sources = np.asarray(sources, dtype=np.int64)
+
+    front = mat[sources]
+    visited = front
+
+    while front.nnz > 0:
+        front = (front @ mat) > visited
+        visited = visited + front
+
+    return visited
+
+
+# if number of start states is not greater than this part of all states,
+# reachable states are found by fronts from start states instead of full closure
+FRONTIER_STARTS_RATIO = 0.05
+
+
+def reachable_state_indices(
+    c: BooleanFA,
+    algorithm: str = "auto",
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Returns indices of states of pairs found by reachable_states as two arrays:
+    indices of start states and indices of final states.
+    """
+
+    start_states = np.flatnonzero(c.start_states)
+    final_states = np.flatnonzero(c.final_states)
+
+    if len(start_states) == 0 or len(final_states) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    if algorithm == "auto":
+        if len(start_states) <= FRONTIER_STARTS_RATIO * c.states_amount:
+            algorithm = "frontier"
+
+        else:
+            algorithm = "closure"
+
+    if algorithm == "closure":
+        reachable = transitive_closure(c.adjacency_matrix())[start_states]
+        reachable = reachable[:, final_states]
+
+    elif algorithm == "frontier":
+        reachable = multi_source_reachability(c.adjacency_matrix(), start_states)
+        reachable = reachable[:, final_states]
+
+    elif algorithm == "scc":
+        reachable = condensed_reachability(
+            c.adjacency_matrix(),
+            start_states,
+            final_states,
+        )
+
+    else:
+        raise ValueError(f"unknown algorithm: {algorithm}")
+
+    reachable = reachable.tocoo()
+    reachable.eliminate_zeros()
+
+    return start_states[reachable.row], final_states[reachable.col]
+
+
+def reachable_states(
+    c: EpsilonNFA | BooleanFA,
+    algorithm: str = "auto",
+) -> set[tuple[any, any]]:
+    """
+    Returns set of pairs of states. Each pair is one of start states and one of final states and
+    means that second state reachable from first state.
+
+    Algorithm could be one of:
+        - "closure": computes transitive closure of all states,
+        - "frontier": traverses FA from start states only,
+        - "scc": computes closure of strongly connected components condensation,
+        - "auto": chooses "frontier" if there is few start states, otherwise "closure".
+    """
+
+    c = as_boolean_fa(c)
+    sources, targets = reachable_state_indices(c, algorithm)
+
+    return {(c.states[i], c.states[j]) for i, j in zip(sources, targets)}
 
 
 def query_graph_kron(
     regex: str,
-    graph: MultiDiGraph,
+    graph: MultiDiGraph | CSRGraph,
     start_states: Iterable[any] = None,
     final_states: Iterable[any] = None,
-) -> set[tuple[any, any]]:
+    algorithm: str = "auto",
+    as_arrays: bool = False,
+) -> set[tuple[any, any]] | NodePairs:
     """
     Finds all pairs of start and final states such that final state reachable from start state
     with constraints specified by the regex.
+
+    Algorithm of reachability is passed to reachable_states.
+    If `as_arrays` is `True`, returns NodePairs over indices of graph nodes instead of set.
     """
 
-    a = regex_to_dfa(regex)
-    b = graph_to_nfa(graph, start_states, final_states)
-    c = intersect(a, b)
+    a = BooleanFA.from_nfa(regex_to_dfa(regex))
+    b = graph_to_boolean_fa(graph, start_states, final_states)
+    c = intersect(a, b, reachable_only=True)
+
+    if not as_arrays:
+        return {(si[1], sj[1]) for si, sj in reachable_states(c, algorithm)}
+
+    m = b.states_amount
+    sources, targets = reachable_state_indices(c, algorithm)
+
+    pairs = np.unique(c.states.codes[sources] % m * m + c.states.codes[targets] % m)
+    return NodePairs(
+        sources=(pairs // m).astype(np.int32),
+        targets=(pairs % m).astype(np.int32),
+        nodes=b.states,
+    )
+
+
+def batched_bfs(
+    a_matrices: list[sp.csr_matrix],
+    b_matrices: list[sp.csr_matrix],
+    a_start: np.ndarray,
+    sources: list[list[int]],
+    n: int,
+    m: int,
+) -> np.ndarray:
+    """
+    Runs BFS over pairs of states of two FAs with n and m states for several sets of sources
+    at once. Matrices of FAs are given for every common label, first FA is expected to be
+    small (e.g. RegExp). Start pairs of k-th set are start states of first FA with its sources.
+
+    Fronts of all sets are stored in one boolean array of shape (n, m, sets), so every step is
+    one sparse product per transition of first FA. Returns boolean array of visited pairs of
+    the same shape: element (i, j, k) is set if pair of states (i, j) is reachable from k-th set.
+    """
+
+    transitions = bfs_transitions(a_matrices, b_matrices)
+    front = bfs_start_front(a_start, sources, n, m)
+
+    visited = front.copy()
+    while front.any():
+        front = bfs_step(transitions, front) & ~visited
+        visited |= front
+
+    return visited
+
+
+def bfs_transitions(
+    a_matrices: list[sp.csr_matrix],
+    b_matrices: list[sp.csr_matrix],
+) -> list[tuple[int, int, sp.csr_matrix]]:
+    """
+    Returns transitions of first FA with transposed matrix of second FA by the same label,
+    see batched_bfs.
+    """
+
+    transitions = []
+    for a, b in zip(a_matrices, b_matrices):
+        a, b = a.tocoo(), b.transpose().tocsr()
+        transitions += [(i, j, b) for i, j in zip(a.row, a.col)]
+
+    return transitions
+
+
+def bfs_start_front(
+    a_start: np.ndarray,
+    sources: list[list[int]],
+    n: int,
+    m: int,
+) -> np.ndarray:
+    """
+    Returns start front of BFS for several sets of sources, see batched_bfs.
+    """
+
+    front = np.zeros((n, m, len(sources)), dtype=np.bool_)
+    for k, js in enumerate(sources):
+        front[np.ix_(a_start, js, [k])] = True
+
+    return front
+
 
-    return {(si[1], sj[1]) for si, sj in reachable_states(c)}
+def bfs_step(
+    transitions: list[tuple[int, int, sp.csr_matrix]],
+    front: np.ndarray,
+) -> np.ndarray:
+    """
+    Returns all pairs of states reachable from front by one transition, see batched_bfs.
+    """
+
+    next_front = np.zeros_like(front)
+    active = front.any(axis=(1, 2))
+
+    for i, j, b in transitions:
+        if active[i]:
+            next_front[j] |= b @ front[i]
+
+    return next_front
+
+
+# maximal number of elements in visited pairs array of one chunk of regexp_reachability
+BFS_CHUNK_ELEMENTS = 2**26
 
 
 def regexp_reachability(
-    regexp: EpsilonNFA,
-    graph: EpsilonNFA,
+    regexp: EpsilonNFA | BooleanFA,
+    graph: EpsilonNFA | BooleanFA,
     start_nodes: Iterable[any],
     for_each: bool,
+    chunk_size: int = None,
+    as_arrays: bool = False,
 ):
     """
     Find all final nodes reachable from specified start nodes with RegExp constraints.
 
     If `for_each` specified, return value is dict of start state to nodes, otherwise is just
-    set of final nodes.
+    set of final nodes. If `as_arrays` is `True`, return value is NodePairs over indices of
+    graph states, without sources if `for_each` isn't specified. Start nodes are processed
+    in chunks of `chunk_size` nodes, BFS of every chunk is run at once, see batched_bfs.
+    If chunk size isn't specified, it is chosen to fit BFS_CHUNK_ELEMENTS visited pairs
+    into chunk.
 
     Graph is represented as FA only for convenience, they start and final states are ignored.
+    RegExp specified as EpsilonNFA is minimized, BooleanFA is used as is.
     """
 
-    regexp = regexp.minimize()
+    if not isinstance(regexp, BooleanFA):
+        regexp = BooleanFA.from_nfa(regexp.minimize())
 
-    a_mapping, b_mapping = states_mapping(regexp), states_mapping(graph)
+    graph = as_boolean_fa(graph)
+    nodes = graph.states_dictionary()
 
-    a_boolean = to_boolean_matrices(regexp, a_mapping)
-    b_boolean = to_boolean_matrices(graph, b_mapping)
+    same_labels = shared_labels(regexp, graph)
 
-    same_labels = set.intersection(set(a_boolean.keys()), set(b_boolean.keys()))
+    a_matrices = [regexp.matrices[regexp.labels_mapping[l]] for l in same_labels]
+    b_matrices = [graph.matrices[graph.labels_mapping[l]] for l in same_labels]
 
-    # NOTE: matrices are transposed
-    both_boolean = {
-        l: sp.block_diag((a_boolean[l], b_boolean[l])).transpose() for l in same_labels
-    }
-
-    n = len(a_mapping)  # number of regexp states
-    m = len(b_mapping)  # number of graph nodes
+    n = regexp.states_amount  # number of regexp states
+    m = graph.states_amount  # number of graph nodes
 
     if for_each:
-        start_nodes_sets = {frozenset({x}) for x in start_nodes}
+        start_nodes = list(dict.fromkeys(start_nodes))
+        sources = [[i] for i in nodes.encode_strict(start_nodes).tolist()]
     else:
-        start_nodes_sets = {frozenset(start_nodes)}
+        sources = [np.unique(nodes.encode_strict(start_nodes)).tolist()]
 
-    del start_nodes
-    final_states = {a_mapping[i] for i in regexp.final_states}
+    if chunk_size is None:
+        chunk_size = max(BFS_CHUNK_ELEMENTS // max(n * m, 1), 1)
 
-    result = {}
-    for start_nodes in start_nodes_sets:
-        current = {
-            (a_mapping[i], b_mapping[j])
-            for i in regexp.start_states
-            for j in start_nodes
-        }
+    start_states = np.flatnonzero(regexp.start_states)
+    final_states = np.flatnonzero(regexp.final_states)
 
-        visited = set()
-        while current:
-            visited |= current
+    result = []
+    for c in range(0, len(sources), chunk_size):
+        chunk = sources[c : c + chunk_size]
+        visited = batched_bfs(a_matrices, b_matrices, start_states, chunk, n, m)
+        reached = visited[final_states].any(axis=0).transpose()
 
-            front = sp.dok_matrix((m, n), dtype=np.bool_)
-            for (i, j) in current:
-                front[j, i] = 1
+        result += [np.flatnonzero(row) for row in reached]
 
-            front = sp.vstack((sp.identity(n, dtype=np.bool_), front), format="csr")
+    b_states = graph.states
 
-            current = set()
-            for adj_mat in both_boolean.values():
-                next_front = sp.coo_matrix(adj_mat @ front)
+    if as_arrays:
+        targets = np.concatenate([np.empty(0, dtype=np.int32)] + result)
+        targets = targets.astype(np.int32)
 
-                a_states = [[] for _ in range(n)]
-                b_states = [[] for _ in range(n)]
-                for i, j, v in zip(next_front.row, next_front.col, next_front.data):
-                    if not v:
-                        continue
+        if not for_each:
+            return NodePairs(sources=None, targets=targets, nodes=b_states)
 
-                    if i < n:
-                        a_states[j].append(i)
-                    else:
-                        b_states[j].append(i - n)
-
-                current |= {
-                    (i, j) for k in range(n) for i in a_states[k] for j in b_states[k]
-                }
-
-            current -= visited
-
-        result[frozenset(start_nodes)] = {j for i, j in visited if i in final_states}
-
-    b_states = [j for _, j in sorted([(idx, s) for s, idx in b_mapping.items()])]
+        return NodePairs(
+            sources=np.repeat(
+                np.array([js[0] for js in sources], dtype=np.int32),
+                np.array([len(js) for js in result], dtype=np.int64),
+            ),
+            targets=targets,
+            nodes=b_states,
+        )
 
     if for_each:
-        return {x: {b_states[j] for j in js} for (x,), js in result.items()}
+        return {x: set(graph.decode_states(js)) for x, js in zip(start_nodes, result)}
 
     else:
-        (result,) = result.values()
-        return {b_states[j] for j in result}
+        (result,) = result
+        return set(graph.decode_states(result))
 
 
 def query_graph_bfs(
     regex: str,
-    graph: MultiDiGraph,
+    graph: MultiDiGraph | CSRGraph,
     start_states: Iterable[any] = None,
     final_states: Iterable[any] = None,
     for_each: bool = False,
+    chunk_size: int = None,
+    as_arrays: bool = False,
 ):
     """
     Finds all nodes in graph reachable from start nodes with RegExp constraints.
@@ -339,11 +1080,26 @@ def query_graph_bfs(
     otherwise returns one set for all start nodes.
 
     If final states specified, it will be used to filter results.
+    Chunk size and `as_arrays` are passed to regexp_reachability.
     """
 
     a = regex_to_dfa(regex)
-    b = graph_to_nfa(graph, [], [])
-    result = regexp_reachability(a, b, start_states, for_each)
+    b = graph_to_boolean_fa(graph, [], [])
+    result = regexp_reachability(a, b, start_states, for_each, chunk_size, as_arrays)
+
+    if as_arrays:
+        if final_states is not None:
+            final_mask = np.zeros(b.states_amount, dtype=np.bool_)
+            final_mask[b.states_dictionary().encode_known(final_states)] = True
+
+            selected = final_mask[result.targets]
+            result = NodePairs(
+                sources=result.sources[selected] if for_each else None,
+                targets=result.targets[selected],
+                nodes=result.nodes,
+            )
+
+        return result
 
     if final_states is not None:
         if for_each:
@@ -357,6 +1113,173 @@ def query_graph_bfs(
     return result
 
 
+def iter_regexp_reachability(
+    regexp: EpsilonNFA | BooleanFA,
+    graph: EpsilonNFA | BooleanFA,
+    start_nodes: Iterable[any],
+    for_each: bool,
+    final_nodes: Iterable[any] = None,
+    limit: int = None,
+    exists_only: bool = False,
+    reflexive: bool = True,
+    chunk_size: int = None,
+) -> Iterator[any]:
+    """
+    Lazy version of regexp_reachability: yields nodes reachable from start nodes as soon as
+    they are found by BFS. If `for_each` specified, yields pairs of start node and reachable
+    node, otherwise yields reachable nodes. Every result is yielded only once.
+
+    If final nodes specified, only they are yielded.
+    If limit specified, stops after `limit` results.
+    If `exists_only` is `True`, yields at most one result for every start node and stops
+    BFS from start node as soon as it found.
+    If `reflexive` is `False`, start nodes are reachable from themselves only by
+    non-empty path, as in query_graph_kron.
+    """
+
+    if limit is not None and limit <= 0:
+        return
+
+    if not isinstance(regexp, BooleanFA):
+        regexp = BooleanFA.from_nfa(regexp.minimize())
+
+    graph = as_boolean_fa(graph)
+    nodes = graph.states_dictionary()
+
+    same_labels = shared_labels(regexp, graph)
+    transitions = bfs_transitions(
+        [regexp.matrices[regexp.labels_mapping[l]] for l in same_labels],
+        [graph.matrices[graph.labels_mapping[l]] for l in same_labels],
+    )
+
+    n = regexp.states_amount  # number of regexp states
+    m = graph.states_amount  # number of graph nodes
+
+    if for_each:
+        start_nodes = list(dict.fromkeys(start_nodes))
+        sources = [[i] for i in nodes.encode_strict(start_nodes).tolist()]
+    else:
+        sources = [np.unique(nodes.encode_strict(start_nodes)).tolist()]
+
+    if final_nodes is None:
+        targets = np.ones((m, 1), dtype=np.bool_)
+    else:
+        targets = np.zeros((m, 1), dtype=np.bool_)
+        targets[nodes.encode_known(final_nodes)] = True
+
+    if chunk_size is None:
+        chunk_size = max(BFS_CHUNK_ELEMENTS // max(n * m, 1), 1)
+
+    start_states = np.flatnonzero(regexp.start_states)
+    final_states = np.flatnonzero(regexp.final_states)
+
+    found = 0
+    for c in range(0, len(sources), chunk_size):
+        chunk = sources[c : c + chunk_size]
+
+        front = bfs_start_front(start_states, chunk, n, m)
+        visited = front.copy() if reflexive else np.zeros_like(front)
+        reached = np.zeros((m, len(chunk)), dtype=np.bool_)
+
+        if not reflexive:
+            front = bfs_step(transitions, front)
+            visited |= front
+
+        while front.any():
+            new = front[final_states].any(axis=0) & targets & ~reached
+            reached |= new
+
+            ks, js = np.nonzero(new.transpose())
+
+            if exists_only:
+                ks, first = np.unique(ks, return_index=True)
+                js = js[first]
+
+                front[:, :, ks] = False
+
+            for k, j in zip(ks.tolist(), graph.decode_states(js)):
+                if for_each:
+                    yield start_nodes[c + k], j
+                else:
+                    yield j
+
+                found += 1
+                if limit is not None and found >= limit:
+                    return
+
+            front = bfs_step(transitions, front) & ~visited
+            visited |= front
+
+
+def iter_query_graph_kron(
+    regex: str,
+    graph: MultiDiGraph | CSRGraph,
+    start_states: Iterable[any] = None,
+    final_states: Iterable[any] = None,
+    limit: int = None,
+    exists_only: bool = False,
+    chunk_size: int = None,
+) -> Iterator[tuple[any, any]]:
+    """
+    Lazy version of query_graph_kron: yields pairs of start and final states as soon as
+    they are found. See iter_regexp_reachability for details about options.
+    """
+
+    b = graph_to_boolean_fa(graph, [], [])
+
+    if start_states is None:
+        start_states = np.arange(b.states_amount)
+    else:
+        start_states = b.states_dictionary().encode(start_states)
+        start_states = start_states[start_states >= 0]
+
+    yield from iter_regexp_reachability(
+        regex_to_dfa(regex),
+        b,
+        b.decode_states(start_states),
+        True,
+        final_nodes=final_states,
+        limit=limit,
+        exists_only=exists_only,
+        reflexive=False,
+        chunk_size=chunk_size,
+    )
+
+
+def iter_query_graph_bfs(
+    regex: str,
+    graph: MultiDiGraph | CSRGraph,
+    start_states: Iterable[any] = None,
+    final_states: Iterable[any] = None,
+    for_each: bool = False,
+    limit: int = None,
+    exists_only: bool = False,
+    chunk_size: int = None,
+) -> Iterator[any]:
+    """
+    Lazy version of query_graph_bfs: yields reachable nodes (or pairs of start node and
+    reachable node if `for_each` is `True`) as soon as they are found.
+    If start states not specified, all graph nodes are used.
+    See iter_regexp_reachability for details about options.
+    """
+
+    b = graph_to_boolean_fa(graph, [], [])
+
+    if start_states is None:
+        start_states = b.decode_states(np.arange(b.states_amount))
+
+    yield from iter_regexp_reachability(
+        regex_to_dfa(regex),
+        b,
+        start_states,
+        for_each,
+        final_nodes=final_states,
+        limit=limit,
+        exists_only=exists_only,
+        chunk_size=chunk_size,
+    )
+
+
 def single_transition(label: any) -> EpsilonNFA:
     """
     Build NFA with two states and one transition by label.
@@ -1,18 +1,61 @@
 from networkx.drawing import nx_pydot
 from collections import namedtuple
 from networkx import MultiDiGraph
+from typing import Iterable
+import tempfile
+import weakref
+import hashlib
+import shutil
+import glob
+import json
+import os
+from scipy.sparse import csgraph
+import scipy.sparse as sp
 import cfpq_data as cfpq
+import pandas as pd
+import numpy as np
 
 
 GraphSummary = namedtuple("GraphSummary", ["nodes_amount", "edges_amount", "labels"])
 
+# per-label statistics of graph for query planning, see statistics
+GraphStatistics = namedtuple(
+    "GraphStatistics",
+    [
+        "nodes_amount",
+        "edges_amount",
+        "labels",
+        "label_edges",
+        "label_sources",
+        "label_targets",
+        "out_degrees",
+        "in_degrees",
+        "scc_sizes",
+    ],
+)
 
-def load_by_name(name: str) -> MultiDiGraph:
+# pairs of nodes as arrays of indices of sources and targets in the nodes lookup table
+NodePairs = namedtuple("NodePairs", ["sources", "targets", "nodes"])
+
+# graph as table of nodes, list of labels and boolean adjacency matrix for every label
+CSRGraph = namedtuple("CSRGraph", ["nodes", "labels", "matrices"])
+
+
+def load_by_name(name: str, directory: str = None) -> MultiDiGraph:
     """
     Loads graph from dataset by name.
+    Graph is loaded from CSV file in local dataset directory if it's there (see prefetch),
+    otherwise it's downloaded. CSV file is parsed on every call: graph store of dataset
+    merges parallel edges with the same label, so it can't restore MultiDiGraph exactly.
+    Use load_csr_by_name to load prefetched graph without parsing.
     """
 
-    return cfpq.graph_from_csv(cfpq.download(name))
+    path, _ = dataset_paths(name, directory)
+
+    if not os.path.isfile(path):
+        path = download_csv(name)
+
+    return cfpq.graph_from_csv(path)
 
 
 def load_from_file(path: str) -> MultiDiGraph:
@@ -24,19 +67,29 @@ def load_from_file(path: str) -> MultiDiGraph:
     return cfpq.graph_from_csv(path)
 
 
-def load(name: str) -> MultiDiGraph:
+def load(name: str, as_csr: bool = False) -> MultiDiGraph | CSRGraph:
     """
     Loads graph by name in order:
     1. load_from_file
     2. load_by_name
+
+    If `as_csr` is `True`, returns CSRGraph from graph store in GRAPH_CACHE_DIR,
+    CSV file is converted to it only once, see load_csr_cached. Otherwise CSV file
+    is parsed on every call, even for prefetched dataset (see load_by_name).
     """
 
     try:
+        if as_csr:
+            return load_csr_cached(name)
+
         return load_from_file(name)
     except Exception as e:
         e1 = e
 
     try:
+        if as_csr:
+            return load_csr_by_name(name)
+
         return load_by_name(name)
     except Exception as e:
         e2 = e
@@ -56,6 +109,96 @@ def summary(graph: MultiDiGraph) -> GraphSummary:
     )
 
 
+# cached statistics of CSRGraph by id of its table of nodes
+STATISTICS_CACHE = {}
+
+
+def statistics(graph: MultiDiGraph | CSRGraph) -> GraphStatistics:
+    """
+    Returns statistics of graph: number of nodes and distinct labeled edges, list of labels,
+    dicts from label to number of its edges, distinct sources and distinct targets,
+    histograms of out- and in-degrees (element d is number of nodes with degree d)
+    and sizes of strongly connected components in descending order.
+
+    Statistics of CSRGraph is computed once and cached while its table of nodes and
+    matrices are alive, CSRGraph is expected to be immutable. It isn't cached if they
+    can't be referenced weakly (e.g. table of nodes is list). Statistics of MultiDiGraph
+    is computed on every call, since graph can be modified in place.
+    """
+
+    if not isinstance(graph, CSRGraph):
+        return compute_statistics(to_csr_graph(graph))
+
+    try:
+        refs = [weakref.ref(part) for part in [graph.nodes, *graph.matrices]]
+    except TypeError:
+        # table of nodes or matrices can't be referenced weakly (e.g. list), isn't cached
+        return compute_statistics(graph)
+
+    key = id(graph.nodes)
+    labels = list(graph.labels)
+
+    cached = STATISTICS_CACHE.get(key)
+    if (
+        cached is not None
+        and len(cached[0]) == len(refs)
+        and all(old() is new() for old, new in zip(cached[0], refs))
+        and cached[1] == labels
+    ):
+        return cached[2]
+
+    result = compute_statistics(graph)
+
+    if cached is None:
+        weakref.finalize(graph.nodes, STATISTICS_CACHE.pop, key, None)
+
+    STATISTICS_CACHE[key] = (refs, labels, result)
+    return result
+
+
+def compute_statistics(graph: CSRGraph) -> GraphStatistics:
+    """
+    Computes statistics of CSRGraph without caching, see statistics.
+    """
+
+    n = len(graph.nodes)
+
+    out_degrees = np.zeros(n, dtype=np.int64)
+    in_degrees = np.zeros(n, dtype=np.int64)
+    label_edges, label_sources, label_targets = {}, {}, {}
+
+    for label, m in zip(graph.labels, graph.matrices):
+        out_counts = np.diff(m.indptr)
+        in_counts = np.bincount(m.indices, minlength=n)
+
+        out_degrees += out_counts
+        in_degrees += in_counts
+
+        label_edges[label] = int(m.nnz)
+        label_sources[label] = int(np.count_nonzero(out_counts))
+        label_targets[label] = int(np.count_nonzero(in_counts))
+
+    adjacency = sp.csr_matrix((n, n), dtype=np.bool_)
+    for m in graph.matrices:
+        adjacency += m
+
+    _, components = csgraph.connected_components(
+        adjacency, directed=True, connection="strong"
+    )
+
+    return GraphStatistics(
+        nodes_amount=n,
+        edges_amount=sum(label_edges.values()),
+        labels=list(graph.labels),
+        label_edges=label_edges,
+        label_sources=label_sources,
+        label_targets=label_targets,
+        out_degrees=np.bincount(out_degrees),
+        in_degrees=np.bincount(in_degrees),
+        scc_sizes=-np.sort(-np.bincount(components)),
+    )
+
+
 def load_summary_by_name(name: str) -> GraphSummary:
     """
     Returns summary about graph loaded by name.
@@ -88,3 +231,481 @@ def build_two_cycles_and_write_dot(n: int, m: int, labels: tuple[str, str], path
     """
 
     write_dot(build_two_cycles(n, m, labels), path)
+
+
+def pairs_to_arrays(pairs: Iterable[tuple[any, any]], nodes: list[any]) -> NodePairs:
+    """
+    Converts pairs of nodes to NodePairs over indices of nodes in the list.
+    """
+
+    dictionary = NodeDictionary(nodes)
+    pairs = list(pairs)
+
+    return NodePairs(
+        sources=dictionary.encode_strict(v for v, _ in pairs).astype(np.int32),
+        targets=dictionary.encode_strict(u for _, u in pairs).astype(np.int32),
+        nodes=nodes,
+    )
+
+
+def arrays_to_pairs(pairs: NodePairs) -> set[tuple[any, any]]:
+    """
+    Converts NodePairs back to set of pairs of nodes.
+    """
+
+    return {
+        (pairs.nodes[i], pairs.nodes[j]) for i, j in zip(pairs.sources, pairs.targets)
+    }
+
+
+def object_array(values: Iterable[any]) -> np.ndarray:
+    """
+    Returns values as one-dimensional NumPy array, values which aren't array are stored
+    as objects (so tuples are kept as elements).
+    """
+
+    if isinstance(values, np.ndarray):
+        return values
+
+    values = list(values)
+    return np.fromiter(values, dtype=object, count=len(values))
+
+
+class NodeDictionary:
+    """
+    Dictionary of nodes of graph: maps nodes to dense indices from 0 to number of nodes
+    in order of table of nodes and back. Both directions are vectorized over arrays.
+    """
+
+    def __init__(self, nodes: Iterable[any]):
+        nodes = object_array(nodes)
+        self.nodes = nodes
+        self.index = pd.Index(nodes, dtype=nodes.dtype, tupleize_cols=False)
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    def encode(self, nodes: Iterable[any]) -> np.ndarray:
+        """
+        Returns array of indices of nodes, -1 for unknown nodes.
+        """
+
+        nodes = object_array(nodes)
+        return self.index.get_indexer(nodes)
+
+    def encode_strict(self, nodes: Iterable[any]) -> np.ndarray:
+        """
+        Returns array of indices of nodes, raises KeyError for unknown nodes.
+        """
+
+        nodes = object_array(nodes)
+        indices = self.encode(nodes)
+
+        if (indices < 0).any():
+            raise KeyError(nodes[np.argmax(indices < 0)])
+
+        return indices
+
+    def encode_known(self, nodes: Iterable[any]) -> np.ndarray:
+        """
+        Returns sorted array of distinct indices of nodes, unknown nodes are skipped.
+        """
+
+        indices = self.encode(nodes)
+        return np.unique(indices[indices >= 0])
+
+    def decode(self, indices: np.ndarray) -> np.ndarray:
+        """
+        Returns array of nodes by indices.
+        """
+
+        return self.nodes[indices]
+
+
+def csr_from_edges(n: int, rows: np.ndarray, cols: np.ndarray) -> sp.csr_matrix:
+    """
+    Builds boolean n x n CSR matrix from arrays of edges, indices are int32 if they fit.
+    Duplicated edges are merged.
+    """
+
+    result = sp.csr_matrix(
+        (np.ones(len(rows), dtype=np.bool_), (rows, cols)),
+        shape=(n, n),
+    )
+    result.sum_duplicates()
+
+    return result
+
+
+def csr_graph_from_edges(
+    sources: np.ndarray,
+    targets: np.ndarray,
+    labels: np.ndarray,
+) -> CSRGraph:
+    """
+    Builds CSRGraph from columns of edges. Nodes and labels are numbered in order of
+    their first occurrence, as in MultiDiGraph built from the same list of edges.
+    """
+
+    ends = np.column_stack((sources, targets)).ravel()
+    ends, nodes = pd.factorize(ends)
+    rows, cols = ends[0::2], ends[1::2]
+
+    label_ids, labels = pd.factorize(labels)
+    matrices = label_matrices(len(nodes), rows, cols, label_ids, len(labels))
+
+    return CSRGraph(nodes=np.asarray(nodes), labels=labels.tolist(), matrices=matrices)
+
+
+def label_matrices(
+    n: int,
+    rows: np.ndarray,
+    cols: np.ndarray,
+    label_ids: np.ndarray,
+    labels_amount: int,
+) -> list[sp.csr_matrix]:
+    """
+    Builds boolean n x n CSR matrix for every label from arrays of edges and their labels,
+    see csr_from_edges.
+    """
+
+    order = np.argsort(label_ids, kind="stable")
+    bounds = np.searchsorted(label_ids[order], np.arange(labels_amount + 1))
+
+    matrices = []
+    for k in range(labels_amount):
+        edges = order[bounds[k] : bounds[k + 1]]
+        matrices.append(csr_from_edges(n, rows[edges], cols[edges]))
+
+    return matrices
+
+
+def to_csr_graph(graph: MultiDiGraph | CSRGraph) -> CSRGraph:
+    """
+    Converts MultiDiGraph to CSRGraph, nodes keep order of `graph.nodes`.
+    CSRGraph is returned as is.
+    """
+
+    if isinstance(graph, CSRGraph):
+        return graph
+
+    nodes = NodeDictionary(graph.nodes)
+    edges = list(graph.edges(data="label"))
+
+    sources, targets, labels = (
+        np.fromiter((e[k] for e in edges), dtype=object, count=len(edges))
+        for k in range(3)
+    )
+
+    rows, cols = nodes.encode(sources), nodes.encode(targets)
+    label_ids, labels = pd.factorize(labels, use_na_sentinel=False)
+
+    return CSRGraph(
+        nodes=nodes.nodes,
+        labels=list(labels),
+        matrices=label_matrices(len(nodes), rows, cols, label_ids, len(labels)),
+    )
+
+
+def to_multidigraph(graph: MultiDiGraph | CSRGraph) -> MultiDiGraph:
+    """
+    Converts CSRGraph to MultiDiGraph by iterating its per-label matrices, nodes keep
+    order of table of nodes. MultiDiGraph is returned as is.
+    """
+
+    if not isinstance(graph, CSRGraph):
+        return graph
+
+    nodes = np.asarray(graph.nodes)
+
+    result = MultiDiGraph()
+    result.add_nodes_from(nodes.tolist())
+
+    for label, m in zip(graph.labels, graph.matrices):
+        m = sp.coo_matrix(m)
+        m.eliminate_zeros()
+
+        sources, targets = nodes[m.row].tolist(), nodes[m.col].tolist()
+        edges = zip(sources, targets)
+        result.add_edges_from((v, u, {"label": label}) for v, u in edges)
+
+    return result
+
+
+def load_csr_from_file(path: str) -> CSRGraph:
+    """
+    Loads graph from CSV file by path, in the same format as load_from_file,
+    directly into CSRGraph without building MultiDiGraph.
+    """
+
+    data = pd.read_csv(
+        path,
+        sep=" ",
+        header=None,
+        names=["from", "to", "label"],
+        engine="c",
+    )
+
+    return csr_graph_from_edges(
+        data["from"].to_numpy(),
+        data["to"].to_numpy(),
+        data["label"].to_numpy(),
+    )
+
+
+# version of graph store format, stores of other versions are rejected by open_graph_store
+GRAPH_STORE_VERSION = 2
+
+# type tags of node names in graph store which aren't all integers or all strings
+GRAPH_STORE_TYPES = {"s": str, "i": int, "f": float, "b": bool}
+
+# directory of graph stores of CSV files converted by load_csr_cached
+GRAPH_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "project", "graphs")
+
+
+def save_graph_store(graph: CSRGraph, path: str):
+    """
+    Saves CSRGraph to directory as graph store: header.json with labels and number of nodes,
+    nodes.npy with table of nodes, and arrays of CSR matrix of k-th label in files
+    k.data.npy, k.indices.npy and k.indptr.npy. All arrays are in NumPy .npy format.
+
+    Node names which aren't integers are stored as strings, if they aren't all strings
+    their types are stored in nodes.types.npy as tags of GRAPH_STORE_TYPES. Labels are
+    stored as JSON values. Raises TypeError if node or label can't be stored with its type.
+    """
+
+    nodes = np.asarray(graph.nodes)
+    types = None
+
+    if not np.issubdtype(nodes.dtype, np.integer):
+        tags = {t: tag for tag, t in GRAPH_STORE_TYPES.items()}
+        values = [v.item() if isinstance(v, np.generic) else v for v in nodes.tolist()]
+
+        for v in values:
+            if type(v) not in tags:
+                raise TypeError(f"cannot store node {v!r} of graph")
+
+        types = np.array([tags[type(v)] for v in values], dtype="U1")
+        if (types == "s").all():
+            types = None
+
+        nodes = np.array([str(v) for v in values], dtype=np.str_)
+
+    labels = [l.item() if isinstance(l, np.generic) else l for l in graph.labels]
+
+    for l in labels:
+        if type(l) not in GRAPH_STORE_TYPES.values():
+            raise TypeError(f"cannot store label {l!r} of graph")
+
+    os.makedirs(path, exist_ok=True)
+
+    np.save(os.path.join(path, "nodes.npy"), nodes)
+
+    if types is not None:
+        np.save(os.path.join(path, "nodes.types.npy"), types)
+
+    for k, m in enumerate(graph.matrices):
+        m = sp.csr_matrix(m, dtype=np.bool_)
+        m.sum_duplicates()
+
+        for name in ("data", "indices", "indptr"):
+            np.save(os.path.join(path, f"{k}.{name}.npy"), getattr(m, name))
+
+    header = {
+        "version": GRAPH_STORE_VERSION,
+        "nodes": len(nodes),
+        "labels": labels,
+    }
+
+    # header is written last, so store without it is incomplete
+    with open(os.path.join(path, "header.json"), "w") as f:
+        json.dump(header, f)
+
+
+def open_graph_store(path: str) -> CSRGraph:
+    """
+    Opens graph store saved by save_graph_store. Arrays aren't read, but mapped to memory
+    by numpy.memmap in read-only mode, so processes opened the same store share its pages.
+    Only table of nodes of different types is read and converted to objects.
+    """
+
+    with open(os.path.join(path, "header.json")) as f:
+        header = json.load(f)
+
+    if header.get("version") != GRAPH_STORE_VERSION:
+        raise ValueError(f"unsupported graph store version: {header.get('version')}")
+
+    def array(name):
+        return np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+
+    n = header["nodes"]
+    matrices = [
+        sp.csr_matrix(
+            (array(f"{k}.data"), array(f"{k}.indices"), array(f"{k}.indptr")),
+            shape=(n, n),
+        )
+        for k in range(len(header["labels"]))
+    ]
+
+    nodes = array("nodes")
+
+    if os.path.isfile(os.path.join(path, "nodes.types.npy")):
+        types = np.load(os.path.join(path, "nodes.types.npy"))
+        values = nodes.astype(object)
+
+        for tag, t in GRAPH_STORE_TYPES.items():
+            selected = types == tag
+
+            if t is bool:
+                values[selected] = [v == "True" for v in nodes[selected].tolist()]
+            else:
+                values[selected] = [t(v) for v in nodes[selected].tolist()]
+
+        nodes = values
+
+    return CSRGraph(nodes=nodes, labels=header["labels"], matrices=matrices)
+
+
+def load_csr_cached(path: str, cache_dir: str = None) -> CSRGraph:
+    """
+    Loads CSRGraph from CSV file by path, see load_csr_from_file. File is converted to
+    graph store in cache directory (GRAPH_CACHE_DIR by default) once, store is identified
+    by absolute path, size and modification time of file. Next calls just open the store.
+    """
+
+    if cache_dir is None:
+        cache_dir = GRAPH_CACHE_DIR
+
+    stat = os.stat(path)
+
+    key = [GRAPH_STORE_VERSION, os.path.abspath(path), stat.st_size, stat.st_mtime_ns]
+    key = json.dumps(key)
+    key = hashlib.sha256(key.encode()).hexdigest()
+    store = os.path.join(cache_dir, key)
+
+    try:
+        return open_graph_store(store)
+    except (OSError, ValueError):
+        pass
+
+    graph = load_csr_from_file(path)
+
+    # store is written to temporary directory and then renamed, so concurrent readers
+    # never see partial store; if another process was first, its store is used;
+    # if cache directory isn't writable or graph can't be stored, loaded graph is returned
+    tmp = None
+
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=cache_dir, suffix=".tmp")
+
+        save_graph_store(graph, tmp)
+        os.rename(tmp, store)
+    except (OSError, TypeError):
+        if tmp is not None:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+        if not os.path.isdir(store):
+            return graph
+
+    try:
+        return open_graph_store(store)
+    except (OSError, ValueError):
+        return graph
+
+
+# local directory of datasets filled by prefetch, could be set by PROJECT_DATASET_DIR
+DATASET_DIR = os.environ.get(
+    "PROJECT_DATASET_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "project", "datasets"),
+)
+
+
+def dataset_paths(name: str, directory: str = None) -> tuple[str, str]:
+    """
+    Returns paths of CSV file and graph store of dataset in local dataset directory
+    (DATASET_DIR by default).
+    """
+
+    if directory is None:
+        directory = DATASET_DIR
+
+    return os.path.join(directory, f"{name}.csv"), os.path.join(directory, name)
+
+
+def download_csv(name: str) -> str:
+    """
+    Downloads graph from dataset by name using cfpq.download and returns path to its CSV file.
+    """
+
+    path = str(cfpq.download(name))
+
+    if os.path.isdir(path):
+        candidates = glob.glob(os.path.join(path, "**", "*.csv"), recursive=True)
+        candidates = sorted(candidates)
+        preferred = [c for c in candidates if os.path.basename(c) == f"{name}.csv"]
+
+        if len(candidates) == 0:
+            raise FileNotFoundError(f"no CSV file of graph {name} in {path}")
+
+        path = (preferred + candidates)[0]
+
+    return path
+
+
+def load_csr_by_name(name: str, directory: str = None) -> CSRGraph:
+    """
+    Loads graph from dataset by name as CSRGraph. Graph store from local dataset directory
+    is opened if it's there (see prefetch), otherwise graph is downloaded and converted
+    by load_csr_cached.
+    """
+
+    _, store = dataset_paths(name, directory)
+
+    try:
+        return open_graph_store(store)
+    except (OSError, ValueError):
+        pass
+
+    return load_csr_cached(download_csv(name))
+
+
+def prefetch(names: Iterable[str], directory: str = None):
+    """
+    Downloads graphs from dataset by names to local dataset directory (DATASET_DIR by
+    default), so load_by_name and load_csr_by_name work without network. Both CSV file
+    and graph store (see save_graph_store) are saved for every graph: load_by_name parses
+    the CSV file, load_csr_by_name opens the store without parsing.
+    """
+
+    if directory is None:
+        directory = DATASET_DIR
+
+    os.makedirs(directory, exist_ok=True)
+
+    for name in names:
+        path, store = dataset_paths(name, directory)
+
+        # both files are written to temporary paths first and removed if writing fails
+        tmp = f"{path}.tmp"
+
+        try:
+            shutil.copyfile(download_csv(name), tmp)
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+
+            raise
+
+        tmp = tempfile.mkdtemp(dir=directory, suffix=".tmp")
+
+        try:
+            save_graph_store(load_csr_from_file(path), tmp)
+            shutil.rmtree(store, ignore_errors=True)
+            os.rename(tmp, store)
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
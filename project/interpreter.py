@@ -252,12 +252,13 @@ class InterpretVisitor(LangVisitor):
     def _load_graph(self, name: str) -> EpsilonNFA:
         """
         Load graph as FA with caching.
+        Graph is opened from graph store, so CSV is parsed only once between runs.
         """
 
         if name in self.load_cache:
             return self.load_cache[name]
 
-        result = fa.graph_to_nfa(graphs.load(name))
+        result = fa.graph_to_boolean_fa(graphs.load(name, as_csr=True)).to_nfa()
         self.load_cache[name] = result
 
         return result
@@ -1,21 +1,66 @@
 from project.fa import (
+    BooleanFA,
+    ProductStates,
+    as_boolean_fa,
+    iterate_transitions,
     states_mapping,
     to_boolean_matrices,
-    from_boolean_matrices,
     transitive_closure,
 )
-from pyformlang.finite_automaton import EpsilonNFA, State, Symbol
+from pyformlang.finite_automaton import Epsilon, EpsilonNFA, State, Symbol
 from functools import total_ordering
 from collections import namedtuple
+from typing import BinaryIO, Iterable
+import weakref
+import json
 import scipy.sparse as sp
 import numpy as np
 
 
 @total_ordering
-class Nonterminal_ordering:
+class Nonterminal:
+    """
+    Nonterminal symbol of RFA.
+
+    Nonterminals are interned: there is only one instance for every value and its type, so
+    comparison usually succeeds by identity and hashes are computed once. Values which are
+    equal but have different types (e.g. Variable("S") and "S") get different instances
+    keeping their own value, but these nonterminals are still equal. Nonterminal is not
+    equal to its value, but could be ordered with it.
+    """
+
+    __slots__ = ("value", "_hash", "__weakref__")
+
+    _instances = weakref.WeakValueDictionary()
+
+    def __new__(cls, value: any):
+        key = (type(value), value)
+        instance = cls._instances.get(key)
+
+        if instance is None:
+            instance = super().__new__(cls)
+            object.__setattr__(instance, "value", value)
+            object.__setattr__(instance, "_hash", hash((value,)))
+
+            cls._instances[key] = instance
+
+        return instance
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Nonterminal is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("Nonterminal is immutable")
+
+    def __hash__(self):
+        return self._hash
+
     def __eq__(self, other):
+        if self is other:
+            return True
+
         if not isinstance(other, Nonterminal):
-            return False
+            return NotImplemented
 
         return self.value == other.value
 
@@ -25,16 +70,53 @@ class Nonterminal_ordering:
 
         return self.value < other.value
 
+    def __repr__(self):
+        return f"Nonterminal(value={self.value!r})"
+
+    def __reduce__(self):
+        return (Nonterminal, (self.value,))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+class SymbolTable:
+    """
+    Maps symbols (terminals and nonterminals) to small consecutive integers,
+    which are used as keys of boolean matrices instead of symbols.
+    """
+
+    def __init__(self, symbols: Iterable[any] = ()):
+        self.symbols = []
+        self.indices = {}
+
+        for s in symbols:
+            self.add(s)
+
+    def add(self, symbol: any) -> int:
+        """
+        Returns index of symbol, adds it to table if it's not present.
+        """
+
+        index = self.indices.get(symbol)
+
+        if index is None:
+            index = self.indices[symbol] = len(self.symbols)
+            self.symbols.append(symbol)
 
-class Nonterminal(namedtuple("Nonterminal", ["value"])):
+        return index
 
-    __lt__ = Nonterminal_ordering.__lt__
-    __le__ = Nonterminal_ordering.__le__
-    __gt__ = Nonterminal_ordering.__gt__
-    __ge__ = Nonterminal_ordering.__ge__
+    def __getitem__(self, symbol: any) -> int:
+        return self.indices[symbol]
 
+    def __contains__(self, symbol: any) -> bool:
+        return symbol in self.indices
 
-del Nonterminal_ordering
+    def __len__(self) -> int:
+        return len(self.symbols)
 
 
 class RFA:
@@ -52,7 +134,7 @@ class RFA:
 
     def to_boolean_matrices(
         self,
-    ) -> dict[Nonterminal, tuple[dict[State, int], dict[Symbol, sp.coo_matrix]]]:
+    ) -> dict[Nonterminal, tuple[dict[State, int], dict[Symbol, sp.csr_matrix]]]:
         """
         Returns dict from non-terminal to boolean matrices of FA, where each FA is represented as
         tuple of mapping from state to number and dict of boolean matrices. See fa.py for details.
@@ -66,6 +148,48 @@ class RFA:
 
         return result
 
+    def to_boolean_fa(self) -> tuple[BooleanFA, np.ndarray]:
+        """
+        Flattens RFA into one BooleanFA with block-diagonal matrices: states of all boxes are
+        numbered one after another in order of `fas` and named as pairs (nonterminal, state).
+        Also returns array with index of box of every state.
+        """
+
+        states, boxes, start_states, final_states = [], [], [], []
+        blocks = []
+
+        boxes_matrices = self.to_boolean_matrices()
+
+        for k, (nt, (mapping, matrices)) in enumerate(boxes_matrices.items()):
+            fa = self.fas[nt]
+            box_states = sorted(mapping, key=mapping.get)
+
+            states.extend((nt, st) for st in box_states)
+            boxes.extend(k for _ in box_states)
+            start_states.extend(st in fa.start_states for st in box_states)
+            final_states.extend(st in fa.final_states for st in box_states)
+            blocks.append((len(box_states), matrices))
+
+        labels = list(dict.fromkeys(l for _, matrices in blocks for l in matrices))
+
+        def block_diagonal(l):
+            label_blocks = [
+                matrices.get(l, sp.csr_matrix((size, size), dtype=np.bool_))
+                for size, matrices in blocks
+            ]
+
+            return sp.block_diag(label_blocks, format="csr", dtype=np.bool_)
+
+        fa = BooleanFA(
+            states,
+            labels,
+            [block_diagonal(l) for l in labels],
+            np.array(start_states, dtype=np.bool_),
+            np.array(final_states, dtype=np.bool_),
+        )
+
+        return fa, np.array(boxes, dtype=np.int64)
+
     def minimize(self):
         """
         Return minimal RFA.
@@ -77,88 +201,245 @@ class RFA:
         )
 
 
-def intersect_with_fa(a: RFA, b: EpsilonNFA) -> EpsilonNFA:
+TensorClosure = namedtuple("TensorClosure", ["states", "closure", "matrices"])
+TensorClosure.__doc__ = """
+Result of tensor algorithm: closure of product of flattened RFA (see RFA.to_boolean_fa)
+and FA, pairs of states of this product (see fa.ProductStates) and matrix of FA states
+reachable by every nonterminal.
+"""
+
+
+def tensor_closure(a: RFA, b: EpsilonNFA | BooleanFA) -> TensorClosure:
     """
-    Intersects RFA with FA. Returns FA, that is, when used in RFA
-    with boxes of input RFA, will be box of start non-terminal.
+    Tensor algorithm: adds to FA edges labeled by nonterminals of RFA until fixpoint.
+
+    RFA is flattened into block-diagonal FA, so every pass builds one Kronecker product
+    of edges added on previous pass and updates one closure of product with it. Rows of
+    closure for pairs of start state of box and FA state give all product states reachable
+    from them, so single source answers could be read from it.
     """
 
-    b_states = len(b.states)
-    b_mapping = states_mapping(b)
-    b_matrices = {l: m.tolil() for l, m in to_boolean_matrices(b, b_mapping).items()}
+    nonterminals = list(a.fas.keys())
 
-    for nt, fa in a.fas.items():
+    # nonterminals have the same indices as their boxes in flattened RFA
+    symbols = SymbolTable(Symbol(nt) for nt in nonterminals)
+
+    b_fa = as_boolean_fa(b)
+    b_states = b_fa.states_amount
+    b_matrices = {symbols.add(l): m for l, m in b_fa.boolean_matrices().items()}
+
+    for k, fa in enumerate(a.fas.values()):
         if fa.accepts(""):
-            mat = sp.eye(b_states, dtype=np.bool_).tolil()
+            mat = sp.identity(b_states, dtype=np.bool_, format="csr")
 
         else:
-            mat = sp.lil_matrix((b_states, b_states), dtype=np.bool_)
+            mat = sp.csr_matrix((b_states, b_states), dtype=np.bool_)
 
-        b_matrices[Symbol(nt)] = mat
+        b_matrices[k] = mat
 
-    a_matrices = a.to_boolean_matrices()
+    a_fa, a_boxes = a.to_boolean_fa()
+    a_matrices = {symbols.add(l): m for l, m in a_fa.boolean_matrices().items()}
 
-    a_start_states = {
-        nt: {nt_mapping[st] for st in a.fas[nt].start_states}
-        for nt, (nt_mapping, _) in a_matrices.items()
-    }
+    n = a_fa.states_amount * b_states
+    closure = sp.csr_matrix((n, n), dtype=np.bool_)
 
-    a_final_states = {
-        nt: {nt_mapping[st] for st in a.fas[nt].final_states}
-        for nt, (nt_mapping, _) in a_matrices.items()
-    }
+    # at first pass all edges are new
+    deltas = b_matrices
+
+    while len(deltas) > 0:
+        delta = sp.csr_matrix((n, n), dtype=np.bool_)
+
+        for l, mat in a_matrices.items():
+            if l in deltas:
+                delta += sp.kron(mat, deltas[l], format="csr")
 
-    changed = True
-    while changed:
-        changed = False
+        # every new path is R (dP R)^+, where R is reflexive closure
+        reflexive = closure + sp.identity(n, dtype=np.bool_, format="csr")
+        new_closure = closure + reflexive @ transitive_closure(delta @ reflexive)
 
-        for nt, (nt_mapping, nt_matrices) in a_matrices.items():
-            n = len(nt_mapping) * len(b_mapping)
+        new_pairs = sp.coo_matrix(new_closure > closure)
+        closure = new_closure
 
-            same_labels = set.intersection(
-                set(nt_matrices.keys()),
-                set(b_matrices.keys()),
+        # pairs from start to final states of boxes, both states are in the same box
+        a_rows, b_rows = np.divmod(new_pairs.row, b_states)
+        a_cols, b_cols = np.divmod(new_pairs.col, b_states)
+        selected = a_fa.start_states[a_rows] & a_fa.final_states[a_cols]
+
+        a_rows, b_rows, b_cols = a_rows[selected], b_rows[selected], b_cols[selected]
+        boxes = a_boxes[a_rows]
+
+        deltas = {}
+
+        for k in np.unique(boxes).tolist():
+            in_box = boxes == k
+
+            edges = sp.csr_matrix(
+                (
+                    np.ones(np.count_nonzero(in_box), dtype=np.bool_),
+                    (b_rows[in_box], b_cols[in_box]),
+                ),
+                shape=(b_states, b_states),
             )
-            result = sp.csr_matrix((n, n), dtype=np.bool_)
 
-            for l in same_labels:
-                result += sp.kron(nt_matrices[l], b_matrices[l])
+            old = b_matrices[k]
+            new = old + edges
 
-            result = sp.coo_matrix(transitive_closure(result))
+            if new.nnz != old.nnz:
+                deltas[k] = new > old
+                b_matrices[k] = new
 
-            for i, j, v in zip(result.row, result.col, result.data):
-                a_i, b_i = i // len(b_mapping), i % len(b_mapping)
-                a_j, b_j = j // len(b_mapping), j % len(b_mapping)
+    return TensorClosure(
+        states=ProductStates(a_fa.states, b_fa.states),
+        closure=closure,
+        matrices={nt: b_matrices[k] for k, nt in enumerate(nonterminals)},
+    )
 
-                if v and a_i in a_start_states[nt] and a_j in a_final_states[nt]:
-                    if b_matrices[nt][b_i, b_j]:
-                        continue
 
-                    b_matrices[nt][b_i, b_j] = True
-                    changed = True
+def intersect_with_fa(a: RFA, b: EpsilonNFA | BooleanFA) -> EpsilonNFA | BooleanFA:
+    """
+    Intersects RFA with FA. Returns FA, that is, when used in RFA
+    with boxes of input RFA, will be box of start non-terminal.
+
+    If FA is BooleanFA, result is BooleanFA too.
+    """
+
+    b_fa = as_boolean_fa(b)
+    matrices = tensor_closure(a, b_fa).matrices
+
+    if a.start_state in matrices:
+        matrix = matrices[a.start_state]
+    else:
+        matrix = sp.csr_matrix((b_fa.states_amount,) * 2, dtype=np.bool_)
 
     # в этом месте я не очень понял, как мне получить РКА из матрицы смежности,
     # но интуитивно кажется, что если мы построим КА для нового нетерминала,
     # используя только полученные переходы по стартовому символу входного РКА,
     # то получим РКА для пересечения
 
-    # а ещё мне не очень понятно, и честно говоря не хочется понимать, как получить
-    # не конкретные состояния, а пары состояний из двух автоматов
-
-    b_states = {i: st for st, i in b_mapping.items()}
-    result = b_matrices[a.start_state].tocoo()
+    # пары состояний из двух автоматов можно получить из tensor_closure
 
-    result_fa = EpsilonNFA(
-        states=b.states.copy(),
-        start_state=b.start_states,
-        final_states=b.final_states,
+    result = BooleanFA(
+        b_fa.states,
+        [Symbol(a.start_state)],
+        [matrix],
+        b_fa.start_states,
+        b_fa.final_states,
     )
 
-    for i, j, v in zip(result.row, result.col, result.data):
-        if not v:
-            continue
+    if isinstance(b, BooleanFA):
+        return result
+
+    return result.to_nfa()
+
+
+# version of binary format of save_rfa, files of other versions are rejected by load_rfa
+RFA_FORMAT_VERSION = 3
+
+# types of nonterminals and labels which save_rfa stores as JSON values with their type
+RFA_VALUE_TYPES = (str, int, float, bool)
+
+
+def save_rfa(rfa: RFA, file: str | BinaryIO):
+    """
+    Saves RFA to file in binary format (NumPy .npz archive).
+
+    Archive contains JSON header with start nonterminal, table of labels and for every box
+    its nonterminal, amount of states and indices of start and final states. Transitions of
+    every box, including epsilon transitions, are stored as arrays of sources, targets and
+    indices of labels.
+    States of boxes are replaced by their indices. Nonterminals and labels are stored as
+    JSON values, raises TypeError if some of them isn't of RFA_VALUE_TYPES.
+    """
+
+    def value_entry(v):
+        v = v.item() if isinstance(v, np.generic) else v
+
+        if type(v) not in RFA_VALUE_TYPES:
+            raise TypeError(f"cannot store symbol {v!r} of RFA")
+
+        return v
+
+    labels = SymbolTable()
+    boxes = []
+    arrays = {}
+
+    for k, (nt, fa) in enumerate(rfa.fas.items()):
+        mapping = states_mapping(fa)
+
+        boxes.append(
+            {
+                "nonterminal": value_entry(nt.value),
+                "states": len(mapping),
+                "start": sorted(mapping[st] for st in fa.start_states),
+                "final": sorted(mapping[st] for st in fa.final_states),
+            }
+        )
+
+        # epsilon transitions are kept as label of its own kind
+        edges = [
+            (mapping[u], mapping[v], labels.add(l))
+            for u, l, v in iterate_transitions(fa)
+        ]
+
+        for i, name in enumerate(("rows", "cols", "labels")):
+            arrays[f"{name}_{k}"] = np.array([e[i] for e in edges], dtype=np.int32)
+
+    def label_entry(l):
+        if isinstance(l, Epsilon):
+            return ["e", ""]
+
+        value = l.value if isinstance(l, Symbol) else l
+
+        if isinstance(value, Nonterminal):
+            return ["n", value_entry(value.value)]
+
+        return ["t", value_entry(value)]
+
+    header = {
+        "version": RFA_FORMAT_VERSION,
+        "start": value_entry(rfa.start_state.value),
+        "labels": [label_entry(l) for l in labels.symbols],
+        "boxes": boxes,
+    }
+
+    header = np.frombuffer(json.dumps(header).encode(), dtype=np.uint8)
+    np.savez(file, header=header, **arrays)
+
+
+def load_rfa(file: str | BinaryIO) -> RFA:
+    """
+    Loads RFA saved by save_rfa. States of boxes are integers.
+    """
+
+    with np.load(file, allow_pickle=False) as data:
+        header = json.loads(data["header"].tobytes().decode())
+
+        if header.get("version") != RFA_FORMAT_VERSION:
+            raise ValueError(f"unsupported RFA format version: {header.get('version')}")
+
+        def label(kind, value):
+            if kind == "e":
+                return Epsilon()
+
+            return Symbol(Nonterminal(value)) if kind == "n" else Symbol(value)
+
+        labels = [label(kind, value) for kind, value in header["labels"]]
+
+        fas = {}
+        for k, box in enumerate(header["boxes"]):
+            fa = EpsilonNFA()
+
+            for i in box["start"]:
+                fa.add_start_state(State(i))
+
+            for i in box["final"]:
+                fa.add_final_state(State(i))
+
+            edges = zip(data[f"rows_{k}"], data[f"cols_{k}"], data[f"labels_{k}"])
+            fa.add_transitions(
+                [(State(int(i)), labels[l], State(int(j))) for i, j, l in edges]
+            )
 
-        si, sj = b_states[i], b_states[j]
-        result_fa.add_transition(si, a.start_state, sj)
+            fas[Nonterminal(box["nonterminal"])] = fa
 
-    return result_fa
+    return RFA(Nonterminal(header["start"]), fas)
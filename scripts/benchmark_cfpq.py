@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+
+from networkx import convert_node_labels_to_integers
+import shared
+import time
+import sys
+
+GRAPHS = ["skos", "generations", "travel", "univ", "atom", "pizza", "wine"]
+GRAMMAR = """
+S -> subClassOf_r S subClassOf | subClassOf_r subClassOf
+S -> type_r S type | type_r type
+"""
+ALGORITHMS = [
+    ("naive", False, False),
+    ("semi-naive", True, False),
+    ("scheduled", True, True),
+]
+
+
+def prepare(graph):
+    """
+    Adds reversed edges with "_r" suffix of label and numbers nodes from zero.
+    """
+
+    result = convert_node_labels_to_integers(graph)
+
+    for v, u, l in list(result.edges(data="label")):
+        result.add_edge(u, v, label=f"{l}_r")
+
+    return result
+
+
+def main():
+    sys.path.insert(1, str(shared.ROOT))
+
+    from project import graphs
+    from project import cfg
+
+    names = sys.argv[1:] if len(sys.argv) > 1 else GRAPHS
+
+    print(
+        f"{'graph':<16}{'algorithm':<12}{'iterations':>12}{'time, s':>12}{'pairs':>12}"
+    )
+
+    for name in names:
+        graph = prepare(graphs.load(name))
+
+        for algorithm, semi_naive, scheduled in ALGORITHMS:
+            start = time.perf_counter()
+            matrices, stats = cfg.matrix_closure_with_stats(
+                graph, GRAMMAR, semi_naive, scheduled
+            )
+            elapsed = time.perf_counter() - start
+
+            pairs = sum(m.nnz for m in matrices.values())
+
+            print(
+                f"{name:<16}{algorithm:<12}{stats.iterations:>12}{elapsed:>12.3f}{pairs:>12}"
+            )
+
+
+if __name__ == "__main__":
+    main()
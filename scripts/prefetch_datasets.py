@@ -0,0 +1,23 @@
+#!/usr/bin/env python3
+
+import shared
+import sys
+
+
+def main():
+    sys.path.insert(1, str(shared.ROOT))
+
+    from project import graphs
+
+    if len(sys.argv) < 2:
+        print(f"usage: {sys.argv[0]} NAME...")
+        print(f"graphs are saved to {graphs.DATASET_DIR}, see PROJECT_DATASET_DIR")
+        sys.exit(1)
+
+    for name in sys.argv[1:]:
+        graphs.prefetch([name])
+        print(f"{name}: saved to {graphs.dataset_paths(name)[1]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,8 @@
 from pyformlang.cfg import CFG, Variable
+from networkx import MultiDiGraph, relabel_nodes
 import project.graphs as graphs
 import project.cfg as cfg
+import numpy as np
 import tempfile
 import re
 
@@ -141,6 +143,27 @@ def test_hellings():
     }
 
 
+def test_hellings_same_as_matrix_algorithm():
+    graph = graphs.build_two_cycles(3, 4, ("a", "b"))
+
+    for grammar in ["S -> a S b | S S | epsilon", "S -> a b | a S b | b S"]:
+        assert cfg.hellings(graph, grammar) == cfg.matrix_algorithm(graph, grammar)
+
+
+def test_demand_hellings():
+    graph = graphs.build_two_cycles(3, 4, ("a", "b"))
+    grammar = "S -> a S b | epsilon"
+
+    closure = cfg.hellings(graph, grammar)
+    demanded = cfg.demand_hellings(graph, grammar, [1])
+
+    assert demanded <= closure
+    assert {(v, u) for v, n, u in demanded if v == 1 and n == Variable("S")} == {
+        (v, u) for v, n, u in closure if v == 1 and n == Variable("S")
+    }
+    assert all(v < 4 for v, n, u in demanded if n == Variable("S"))
+
+
 def test_cfpq_hellings():
     graph = graphs.build_two_cycles(1, 2, ("a", "b"))
 
@@ -224,6 +247,84 @@ def test_matrix_algorithm():
     }
 
 
+def test_matrix_closure_semi_naive():
+    graph = graphs.build_two_cycles(3, 4, ("a", "b"))
+    grammar = "S -> a S b | S S | epsilon"
+
+    naive, naive_stats = cfg.matrix_closure_with_stats(graph, grammar, False)
+    semi_naive, stats = cfg.matrix_closure_with_stats(graph, grammar, True, False)
+
+    assert naive.keys() == semi_naive.keys()
+    for nt in naive.keys():
+        assert (naive[nt] != semi_naive[nt]).nnz == 0
+
+    assert stats == naive_stats
+    assert stats.iterations == len(stats.nonzeroes) - 1
+    assert stats.nonzeroes[-1] == stats.nonzeroes[-2]
+
+
+def test_dependency_order():
+    grammar = CFG.from_text("S -> A S B | A B\nA -> a\nB -> B b | b")
+
+    order = cfg.dependency_order(grammar)
+
+    assert sorted(map(len, order)) == [1, 1, 1]
+    assert order.index({Variable("A")}) < order.index({Variable("S")})
+    assert order.index({Variable("B")}) < order.index({Variable("S")})
+
+
+def test_matrix_closure_scheduled():
+    graph = graphs.build_two_cycles(3, 4, ("a", "b"))
+    grammar = "S -> A S B | A B\nA -> a A | a\nB -> b B | b"
+
+    expected = cfg.matrix_closure_with_stats(graph, grammar, True, False)[0]
+    actual, stats = cfg.matrix_closure_with_stats(graph, grammar, True, True)
+
+    assert expected.keys() == actual.keys()
+    for nt in expected.keys():
+        assert (expected[nt] != actual[nt]).nnz == 0
+
+    assert stats.iterations == len(stats.nonzeroes) - 1
+    assert stats.nonzeroes[-1] == sum(m.nnz for m in actual.values())
+
+
+def test_masked_matrix_closure():
+    graph = graphs.build_two_cycles(3, 4, ("a", "b"))
+    grammar = "S -> a S b | epsilon"
+
+    closure = cfg.matrix_closure(graph, grammar)
+    masked = cfg.masked_matrix_closure(graph, grammar, [1])
+
+    s = Variable("S")
+    nodes = graphs.NodeDictionary(graph.nodes)
+
+    first = nodes.encode([1])[0]
+    assert (masked[s][first] != closure[s][first]).nnz == 0
+    assert masked[s][nodes.encode([4, 5, 6, 7])].nnz == 0
+
+
+def test_masked_matrix_closure_iterations():
+    graph = MultiDiGraph()
+    for v in range(40):
+        graph.add_edge(v, v + 1, label="a" if v < 20 else "b")
+
+    grammar = "S -> a S b | a b | S S"
+    s = Variable("S")
+
+    closure, stats = cfg.matrix_closure_with_stats(graph, grammar)
+
+    for start_nodes in ([0, 1], [15], list(graph.nodes)):
+        masked, masked_stats = cfg.masked_matrix_closure_with_stats(
+            graph, grammar, start_nodes
+        )
+
+        assert masked_stats.iterations <= stats.iterations
+        assert masked_stats.nonzeroes[-1] <= stats.nonzeroes[-1]
+
+        for v in start_nodes:
+            assert (masked[s][v] != closure[s][v]).nnz == 0
+
+
 def test_cfpq_matrix():
     graph = graphs.build_two_cycles(1, 2, ("a", "b"))
 
@@ -243,3 +344,77 @@ def test_cfpq_matrix():
         (1, 2),
         (1, 3),
     }
+
+
+def test_cfpq_as_arrays():
+    graph = graphs.build_two_cycles(1, 2, ("a", "b"))
+    grammar = CFG.from_text("S -> a S b | epsilon")
+
+    for cfpq in (cfg.cfpq_hellings, cfg.cfpq_matrix, cfg.cfpq_tensor):
+        result = cfpq(graph, grammar, [0, 1], [2, 3], as_arrays=True)
+
+        assert result.sources.dtype == np.int32
+        assert result.targets.dtype == np.int32
+        assert graphs.arrays_to_pairs(result) == {(0, 2), (0, 3), (1, 2), (1, 3)}
+
+
+def test_cfpq_tensor():
+    graph = graphs.build_two_cycles(1, 2, ("a", "b"))
+
+    grammar = "S -> a S | epsilon"
+
+    assert cfg.cfpq_tensor(graph, grammar, [0]) == ({(0, 0), (0, 1)})
+
+    grammar = "S -> S b | epsilon"
+
+    assert cfg.cfpq_tensor(graph, grammar, None, [0]) == {(0, 0), (3, 0), (2, 0)}
+
+    grammar = CFG.from_text("S -> a S b | epsilon")
+
+    assert cfg.cfpq_tensor(graph, grammar, [0, 1], [2, 3]) == {
+        (0, 2),
+        (0, 3),
+        (1, 2),
+        (1, 3),
+    }
+
+
+def test_cfpq_tensor_same_as_hellings():
+    graph = graphs.build_two_cycles(3, 4, ("a", "b"))
+
+    for grammar in [
+        "S -> a S b | S S | epsilon",
+        "S -> A B\nA -> a A | a\nB -> b B | b",
+    ]:
+        assert cfg.cfpq_tensor(graph, grammar) == cfg.cfpq_hellings(graph, grammar)
+
+
+def test_cfpq_non_integer_nodes():
+    graph = relabel_nodes(
+        graphs.build_two_cycles(3, 4, ("a", "b")), lambda v: f"v{v * 10}"
+    )
+    grammar = "S -> a S b | a b"
+
+    expected = cfg.cfpq_hellings(graph, grammar)
+    assert len(expected) > 0
+
+    assert cfg.cfpq_matrix(graph, grammar) == expected
+    assert cfg.cfpq_tensor(graph, grammar) == expected
+    assert cfg.cfpq_matrix(graph, grammar, ["v10", "x"]) == {
+        (v, u) for v, u in expected if v == "v10"
+    }
+    assert {(v, u) for v, _, u in cfg.matrix_algorithm(graph, grammar)} >= expected
+
+
+def test_cfpq_hellings_csr_graph():
+    graph = graphs.build_two_cycles(3, 4, ("a", "b"))
+    csr = graphs.to_csr_graph(graph)
+    grammar = "S -> a S b | a b"
+
+    expected = cfg.cfpq_hellings(graph, grammar)
+
+    assert cfg.cfpq_hellings(csr, grammar) == expected
+    assert cfg.cfpq_hellings(csr, grammar, [1]) == {
+        (v, u) for v, u in expected if v == 1
+    }
+    assert cfg.hellings(csr, grammar) == cfg.hellings(graph, grammar)
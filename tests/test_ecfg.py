@@ -1,6 +1,8 @@
 from pyformlang.regular_expression import Regex
 from pyformlang.cfg import CFG
-from project.ecfg import ECFG
+from project.ecfg import ECFG, compile_rfa
+import tempfile
+import os
 
 
 def test_ecfg_from_text():
@@ -26,6 +28,14 @@ def non_strict_eq(s1, s2):
     return set(s1) == set(s2)
 
 
+def test_ecfg_from_cfg_epsilon():
+    e = ECFG.from_cfg(CFG.from_text("S -> a S b | epsilon"))
+
+    rfa = e.to_rfa()
+
+    assert rfa.fas[rfa.start_state].accepts("")
+
+
 def test_ecfg_from_cfg():
     c = CFG.from_text(
         """
@@ -43,3 +53,45 @@ S -> num
         e.rules["S"].get_tree_str(),
         Regex("num | \\( S \\) | S \\+ S | S - S | S \\* S | S / S").get_tree_str(),
     )
+
+
+def test_compile_rfa():
+    text = "S -> a S b | $"
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        compiled = compile_rfa(text, cache_dir=cache_dir)
+        assert len(os.listdir(cache_dir)) == 1
+
+        cached = compile_rfa(text, cache_dir=cache_dir)
+        assert len(os.listdir(cache_dir)) == 1
+
+        compile_rfa("S -> a b", cache_dir=cache_dir)
+        assert len(os.listdir(cache_dir)) == 2
+
+    expected = ECFG.from_text(text).to_rfa().minimize()
+
+    for rfa in (compiled, cached):
+        assert rfa.start_state == expected.start_state
+        assert rfa.fas.keys() == expected.fas.keys()
+
+        for nt, box in expected.fas.items():
+            assert rfa.fas[nt].is_equivalent_to(box)
+
+
+def test_compile_rfa_unwritable_cache():
+    text = "S -> a S b | $"
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cache_dir = os.path.join(tmp, "file")
+
+        with open(cache_dir, "w"):
+            pass
+
+        rfa = compile_rfa(text, cache_dir=cache_dir)
+        assert os.listdir(tmp) == ["file"]
+
+    expected = ECFG.from_text(text).to_rfa().minimize()
+
+    assert rfa.fas.keys() == expected.fas.keys()
+    for nt, box in expected.fas.items():
+        assert rfa.fas[nt].is_equivalent_to(box)
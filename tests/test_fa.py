@@ -4,6 +4,7 @@ from pyformlang.finite_automaton import (
     State,
     Symbol,
 )
+from networkx import relabel_nodes
 import networkx.algorithms.isomorphism as iso
 from hypothesis.strategies import from_regex
 from scipy.sparse import coo_matrix
@@ -183,6 +184,37 @@ def test_to_boolean_matrices():
     ).all()
 
 
+def test_to_boolean_matrices_no_transitions():
+    nfa = EpsilonNFA()
+
+    nfa.add_transition(0, "a", 1)
+    nfa.add_transition(1, "a", 0)
+    nfa.add_symbol("b")
+
+    mapping = {0: 0, 1: 1}
+    boolean = fa.to_boolean_matrices(nfa, mapping)
+
+    assert set(boolean.keys()) == {"a", "b"}
+    assert (boolean["a"].toarray() == np.array([[False, True], [True, False]])).all()
+    assert boolean["b"].shape == (2, 2)
+    assert boolean["b"].count_nonzero() == 0
+
+
+def test_boolean_matrices_from_edges():
+    boolean = fa.boolean_matrices_from_edges(
+        3,
+        ["x", "y", "z"],
+        [0, 1, 2, 0],
+        [1, 2, 0, 1],
+        [1, 0, 1, 1],
+    )
+
+    assert set(boolean.keys()) == {"x", "y", "z"}
+    assert set(zip(*boolean["x"].nonzero())) == {(1, 2)}
+    assert set(zip(*boolean["y"].nonzero())) == {(0, 1), (2, 0)}
+    assert boolean["z"].count_nonzero() == 0
+
+
 def test_from_boolean_matrices():
     boolean = {
         "0": coo_matrix(
@@ -260,6 +292,216 @@ def test_adjacency_matrix():
     ).all()
 
 
+def test_boolean_fa_round_trip():
+    nfa = EpsilonNFA()
+
+    nfa.add_transition(0, "a", 1)
+    nfa.add_transition(1, "epsilon", 2)
+    nfa.add_transition(2, "b", 0)
+    nfa.add_transition(2, "b", 2)
+    nfa.add_start_state(0)
+    nfa.add_final_state(2)
+    nfa.add_final_state(3)
+
+    bfa = fa.BooleanFA.from_nfa(nfa)
+
+    assert bfa.states_amount == 4
+    assert set(bfa.states) == {0, 1, 2, 3}
+    assert {bfa.states[i] for i in bfa.start_states.nonzero()[0]} == {0}
+    assert {bfa.states[i] for i in bfa.final_states.nonzero()[0]} == {2, 3}
+
+    result = bfa.to_nfa()
+
+    assert result.states == nfa.states
+    assert result.symbols == nfa.symbols
+    assert result.start_states == nfa.start_states
+    assert result.final_states == nfa.final_states
+    assert set(fa.iterate_transitions(result)) == set(fa.iterate_transitions(nfa))
+
+
+def test_graph_to_boolean_fa():
+    graph = g.build_two_cycles(1, 2, ("a", "b"))
+    bfa = fa.graph_to_boolean_fa(graph, [0])
+
+    assert set(bfa.states) == {0, 1, 2, 3}
+    assert {bfa.states[i] for i in bfa.start_states.nonzero()[0]} == {0}
+    assert bfa.final_states.all()
+    assert bfa.to_nfa().is_equivalent_to(fa.graph_to_nfa(graph, [0]))
+
+
+def test_intersect_boolean_fa():
+    graph = g.build_two_cycles(1, 2, ("a", "b"))
+
+    a = fa.BooleanFA.from_nfa(fa.regex_to_dfa("a b*"))
+    b = fa.graph_to_boolean_fa(graph)
+    c = fa.intersect(a, b)
+
+    assert isinstance(c, fa.BooleanFA)
+    assert c.states_amount == a.states_amount * b.states_amount
+    assert {(si[1], sj[1]) for si, sj in fa.reachable_states(c)} == {
+        (0, 1),
+        (1, 0),
+        (1, 2),
+        (1, 3),
+    }
+
+
+def test_product_states():
+    states = fa.ProductStates(["a", "b"], [1, 2, 3])
+
+    assert len(states) == 6
+    assert list(states) == [("a", 1), ("a", 2), ("a", 3), ("b", 1), ("b", 2), ("b", 3)]
+
+    states = fa.ProductStates(["a", "b"], [1, 2, 3], np.array([1, 5]))
+
+    assert len(states) == 2
+    assert list(states) == [("a", 2), ("b", 3)]
+
+    with pytest.raises(IndexError):
+        states[2]
+
+
+def test_intersect_reachable_only():
+    graph = g.build_two_cycles(2, 3, ("a", "b"))
+
+    a = fa.BooleanFA.from_nfa(fa.regex_to_dfa("a b*"))
+    b = fa.graph_to_boolean_fa(graph, [1])
+
+    full = fa.intersect(a, b)
+    lazy = fa.intersect(a, b, reachable_only=True)
+
+    assert lazy.states_amount < full.states_amount
+    assert fa.reachable_states(lazy) == fa.reachable_states(full)
+    assert lazy.to_nfa().is_equivalent_to(full.to_nfa())
+
+
+def test_transitive_closure():
+    chain = coo_matrix(
+        (np.ones(7, dtype=np.bool_), (np.arange(7), np.arange(1, 8))),
+        shape=(8, 8),
+    )
+
+    closure, stats = fa.transitive_closure_with_stats(chain)
+
+    assert (closure.toarray() == np.triu(np.ones((8, 8), dtype=np.bool_), 1)).all()
+    assert stats.rounds == 4
+    assert stats.nonzeroes == [7, 13, 22, 28, 28]
+
+    closure, stats = fa.transitive_closure_with_stats(closure)
+    assert stats.rounds == 1
+    assert stats.nonzeroes == [28, 28]
+
+
+def test_transitive_closure_cycle():
+    cycle = coo_matrix(
+        (np.ones(8, dtype=np.bool_), (np.arange(8), (np.arange(8) + 1) % 8)),
+        shape=(8, 8),
+    )
+
+    closure, stats = fa.transitive_closure_with_stats(cycle)
+
+    assert (closure.toarray() == np.ones((8, 8), dtype=np.bool_)).all()
+    assert stats.nonzeroes == [8, 16, 32, 64, 64]
+
+    # cycle with tail and isolated node
+    mat = np.zeros((6, 6), dtype=np.bool_)
+    mat[[0, 1, 2, 3, 4], [1, 2, 3, 0, 0]] = True
+
+    expected = mat.copy()
+    for _ in range(6):
+        expected |= (expected.astype(np.int64) @ expected.astype(np.int64)) > 0
+
+    assert (fa.transitive_closure(coo_matrix(mat)).toarray() == expected).all()
+
+
+def test_transitive_closure_empty():
+    closure, stats = fa.transitive_closure_with_stats(
+        coo_matrix((0, 0), dtype=np.bool_)
+    )
+
+    assert closure.shape == (0, 0)
+    assert stats.rounds == 0
+
+    assert fa.transitive_closure(coo_matrix((3, 3), dtype=np.bool_)).nnz == 0
+
+
+def test_multi_source_reachability():
+    graph = fa.graph_to_boolean_fa(g.build_two_cycles(2, 3, ("a", "b")))
+    adjacency = graph.adjacency_matrix()
+    mapping = graph.states_mapping()
+
+    sources = [mapping[1], mapping[4]]
+    reachable = fa.multi_source_reachability(adjacency, sources)
+
+    assert (
+        reachable.toarray() == fa.transitive_closure(adjacency)[sources].toarray()
+    ).all()
+
+
+def test_reachable_states_algorithms():
+    a = fa.BooleanFA.from_nfa(fa.regex_to_dfa("a* b"))
+    b = fa.graph_to_boolean_fa(g.build_two_cycles(2, 3, ("a", "b")), [1])
+    c = fa.intersect(a, b)
+
+    expected = fa.reachable_states(c, "closure")
+
+    assert {(si[1], sj[1]) for si, sj in expected} == {(1, 3)}
+    assert fa.reachable_states(c, "frontier") == expected
+    assert fa.reachable_states(c, "scc") == expected
+    assert fa.reachable_states(c) == expected
+
+    with pytest.raises(ValueError):
+        fa.reachable_states(c, "unknown")
+
+
+def test_condensation():
+    mat = coo_matrix(
+        (
+            np.ones(6, dtype=np.bool_),
+            ([0, 1, 1, 2, 3, 4], [1, 0, 2, 3, 2, 4]),
+        ),
+        shape=(6, 6),
+    )
+
+    components, dag, cyclic = fa.condensation(mat)
+
+    assert components[0] == components[1]
+    assert components[2] == components[3]
+    assert len(set(components)) == 4
+    assert dag.nnz == 1
+    assert dag[components[1], components[2]]
+
+    assert list(cyclic[components]) == [True, True, True, True, True, False]
+
+
+def test_transitive_closure_scc():
+    graph = fa.graph_to_boolean_fa(g.build_two_cycles(3, 4, ("a", "b")))
+    adjacency = graph.adjacency_matrix().tolil()
+    adjacency[0, 0] = False
+    adjacency[1, 1] = True
+
+    expected = fa.transitive_closure(adjacency).toarray()
+
+    assert (fa.transitive_closure(adjacency, "scc").toarray() == expected).all()
+    assert (
+        fa.condensed_reachability(adjacency, [1, 2], [0, 3]).toarray()
+        == expected[[1, 2]][:, [0, 3]]
+    ).all()
+
+    with pytest.raises(ValueError):
+        fa.transitive_closure(adjacency, "unknown")
+
+
+def test_transitive_closure_scc_dag():
+    # chain with shortcuts and one cycle in the middle
+    mat = np.zeros((12, 12), dtype=np.bool_)
+    mat[np.arange(11), np.arange(1, 12)] = True
+    mat[[0, 3, 6, 6], [5, 9, 4, 11]] = True
+
+    expected = fa.transitive_closure(coo_matrix(mat)).toarray()
+    assert (fa.transitive_closure(coo_matrix(mat), "scc").toarray() == expected).all()
+
+
 def test_intersect_self():
     graph = fa.graph_to_nfa(g.load_by_name("generations"))
     assert graph.is_equivalent_to(fa.intersect(graph, graph))
@@ -396,6 +638,53 @@ def test_regexp_reachability_with_regex():
     ) == {81: {34}}
 
 
+def test_regexp_reachability_chunks():
+    graph = fa.graph_to_boolean_fa(g.build_two_cycles(3, 4, ("a", "b")))
+    regex = fa.regex_to_dfa("a* b b")
+
+    expected = {
+        0: {5},
+        1: {5},
+        2: {5},
+        3: {5},
+        4: {6},
+        5: {7},
+        6: {0},
+        7: {4},
+    }
+
+    assert fa.regexp_reachability(regex, graph, range(8), True) == expected
+
+    for chunk_size in (1, 3, 8, 100):
+        assert (
+            fa.regexp_reachability(regex, graph, range(8), True, chunk_size) == expected
+        )
+
+    assert fa.regexp_reachability(regex, graph, range(8), False, 3) == {0, 4, 5, 6, 7}
+
+
+def test_batched_bfs():
+    a = fa.BooleanFA.from_nfa(fa.regex_to_dfa("a b"))
+    b = fa.graph_to_boolean_fa(g.build_two_cycles(3, 4, ("a", "b")))
+    b_mapping = b.states_mapping()
+
+    labels = fa.shared_labels(a, b)
+    visited = fa.batched_bfs(
+        [a.matrices[a.labels_mapping[l]] for l in labels],
+        [b.matrices[b.labels_mapping[l]] for l in labels],
+        a.start_states.nonzero()[0],
+        [[b_mapping[3]], [b_mapping[1], b_mapping[2]]],
+        a.states_amount,
+        b.states_amount,
+    )
+
+    assert visited.shape == (a.states_amount, b.states_amount, 2)
+
+    (final,) = a.final_states.nonzero()[0]
+    assert {b.states[j] for j in visited[final, :, 0].nonzero()[0]} == {4}
+    assert visited[final, :, 1].sum() == 0
+
+
 def test_query_graph_bfs_empty():
     graph = g.load_by_name("generations")
     assert fa.query_graph_bfs("", graph, graph.nodes, graph.nodes, False) == set()
@@ -720,6 +1009,41 @@ def test_query_graph_bfs_some():
     }
 
 
+def test_iter_query_graph_kron():
+    graph = g.build_two_cycles(3, 4, ("a", "b"))
+    expected = fa.query_graph_kron("a* b", graph, [1, 2, 5], None)
+
+    result = list(fa.iter_query_graph_kron("a* b", graph, [1, 2, 5]))
+    assert len(result) == len(expected)
+    assert set(result) == expected
+
+    assert len(list(fa.iter_query_graph_kron("a* b", graph, limit=2))) == 2
+    assert list(fa.iter_query_graph_kron("a*", graph, limit=0)) == []
+    assert list(fa.iter_query_graph_kron("a*", graph, limit=-1)) == []
+
+    result = list(fa.iter_query_graph_kron("a* b*", graph, [1, 2], exists_only=True))
+    assert [s for s, _ in result] == [1, 2]
+    assert set(result) <= fa.query_graph_kron("a* b*", graph, [1, 2])
+
+
+def test_iter_query_graph_bfs():
+    graph = g.build_two_cycles(3, 4, ("a", "b"))
+
+    expected = fa.query_graph_bfs("a* b b", graph, [1, 4], None, True)
+    result = list(fa.iter_query_graph_bfs("a* b b", graph, [1, 4], None, True))
+
+    assert len(result) == 2
+    assert {s: {v for s1, v in result if s1 == s} for s in [1, 4]} == expected
+
+    assert set(fa.iter_query_graph_bfs("a*", graph, [1], [0, 1, 5])) == {0, 1}
+    assert list(fa.iter_query_graph_bfs("a*", graph, [1], limit=1)) == [1]
+    assert list(fa.iter_query_graph_bfs("a*", graph, [1], limit=0)) == []
+
+    expected = fa.query_graph_bfs("a* b", graph, graph.nodes, None, True)
+    result = set(fa.iter_query_graph_bfs("a* b", graph, for_each=True))
+    assert {s: {v for s1, v in result if s1 == s} for s in graph.nodes} == expected
+
+
 @given(from_regex("[a-z]+", fullmatch=True))
 def test_single_transition(test):
     result = fa.single_transition(test)
@@ -771,3 +1095,50 @@ def test_kleene_star():
     assert a_star.accepts("")
     assert a_star.accepts("a")
     assert a_star.accepts("aaaaa")
+
+
+def test_query_graph_kron_as_arrays():
+    graph = g.build_two_cycles(3, 4, ("a", "b"))
+    result = fa.query_graph_kron("a* b", graph, [1, 2, 5], None, as_arrays=True)
+
+    assert result.sources.dtype == np.int32
+    assert result.targets.dtype == np.int32
+    assert g.arrays_to_pairs(result) == fa.query_graph_kron("a* b", graph, [1, 2, 5])
+
+
+def test_query_graph_csr():
+    graph = g.build_two_cycles(3, 4, ("a", "b"))
+    sources, targets, labels = zip(*graph.edges(data="label"))
+    csr = g.csr_graph_from_edges(np.array(sources), np.array(targets), np.array(labels))
+
+    assert fa.query_graph_kron("a* b", csr, [1, 2, 5]) == fa.query_graph_kron(
+        "a* b", graph, [1, 2, 5]
+    )
+    assert fa.query_graph_bfs("a* b b", csr, [1, 4], None, True) == {1: {5}, 4: {6}}
+
+
+def test_query_graph_bfs_as_arrays():
+    graph = g.build_two_cycles(3, 4, ("a", "b"))
+
+    result = fa.query_graph_bfs("a* b b", graph, [1, 4], None, True, as_arrays=True)
+    assert g.arrays_to_pairs(result) == {(1, 5), (4, 6)}
+
+    result = fa.query_graph_bfs("a* b b", graph, [1, 4], [6], False, as_arrays=True)
+    assert result.sources is None
+    assert [result.nodes[i] for i in result.targets] == [6]
+
+
+def test_graph_to_boolean_fa_states_dictionary():
+    graph = relabel_nodes(g.build_two_cycles(3, 4, ("a", "b")), lambda v: ("v", v))
+    b = fa.graph_to_boolean_fa(graph, [("v", 1), "missing"])
+
+    assert b.states_dictionary() is b.states_dictionary()
+    assert list(b.decode_states(np.flatnonzero(b.start_states))) == [("v", 1)]
+
+    assert fa.query_graph_bfs("a* b b", graph, [("v", 1)], [("v", 5)]) == {("v", 5)}
+    assert set(fa.iter_query_graph_kron("a* b b", graph, [("v", 1), "missing"])) == {
+        (("v", 1), ("v", 5))
+    }
+
+    with pytest.raises(KeyError):
+        fa.regexp_reachability(fa.regex_to_dfa("a"), b, ["missing"], False)
@@ -1,7 +1,10 @@
 import project.graphs as g
+from networkx import MultiDiGraph, relabel_nodes
 import cfpq_data as cfpq
+import numpy as np
 import tempfile
 import pytest
+import os
 
 
 def test_summary():
@@ -11,6 +14,173 @@ def test_summary():
     assert summary == (42, 42, {"x"})
 
 
+def test_statistics():
+    graph = g.build_two_cycles(3, 5, ("x", "y"))
+    graph.add_edge(1, 0, label="z")
+    graph.add_edge(1, 0, label="z")
+
+    stats = g.statistics(graph)
+
+    assert (stats.nodes_amount, stats.edges_amount) == (9, 11)
+    assert set(stats.labels) == {"x", "y", "z"}
+    assert stats.label_edges == {"x": 4, "y": 6, "z": 1}
+    assert stats.label_sources["z"] == 1 and stats.label_targets["z"] == 1
+    assert list(stats.out_degrees) == [0, 7, 2]
+    assert list(stats.in_degrees) == [0, 8, 0, 1]
+    assert list(stats.scc_sizes) == [9]
+
+    csr = g.to_csr_graph(graph)
+    csr_stats = g.statistics(csr)
+    assert csr_stats.label_edges == stats.label_edges
+    assert list(csr_stats.in_degrees) == list(stats.in_degrees)
+    assert g.statistics(csr) is csr_stats
+
+    # another graph over the same table of nodes
+    label = csr.labels[0]
+    shared = g.CSRGraph(nodes=csr.nodes, labels=[label], matrices=csr.matrices[:1])
+    assert g.statistics(shared).label_edges == {label: stats.label_edges[label]}
+
+    graph.remove_edge(1, 0)
+    graph.add_edge(0, "new", label="w")
+    assert "w" in g.summary(graph).labels
+    assert list(g.statistics(graph).scc_sizes) == [9, 1]
+
+
+def test_statistics_not_weakly_referenced():
+    csr = g.to_csr_graph(g.build_two_cycles(2, 3, ("a", "b")))
+
+    listed = g.CSRGraph(nodes=list(csr.nodes), labels=csr.labels, matrices=csr.matrices)
+    assert g.statistics(listed).label_edges == {"a": 3, "b": 4}
+
+    labels = np.array(csr.labels, dtype=object)
+    arrays = g.CSRGraph(nodes=csr.nodes, labels=labels, matrices=csr.matrices)
+    assert g.statistics(arrays).label_edges == {"a": 3, "b": 4}
+    assert g.statistics(arrays).label_edges == {"a": 3, "b": 4}
+
+
+def test_summary_not_cached():
+    graph = MultiDiGraph()
+    graph.add_edge(0, 1, label="a")
+    assert g.summary(graph).labels == {"a"}
+
+    graph.remove_edge(0, 1)
+    graph.add_edge(1, 0, label="c")
+    assert g.summary(graph).labels == {"c"}
+
+
+def test_pairs_to_arrays():
+    nodes = ["x", "y", "z"]
+    pairs = g.pairs_to_arrays({("x", "z"), ("z", "y")}, nodes)
+
+    assert pairs.sources.dtype == np.int32
+    assert sorted(zip(pairs.sources, pairs.targets)) == [(0, 2), (2, 1)]
+    assert g.arrays_to_pairs(pairs) == {("x", "z"), ("z", "y")}
+
+
+def test_node_dictionary():
+    nodes = g.NodeDictionary(["x", 10, ("a", 1), 3])
+
+    assert len(nodes) == 4
+    assert list(nodes.encode([3, "x", "missing", ("a", 1)])) == [3, 0, -1, 2]
+    assert list(nodes.encode_known([3, "missing", 3, 10])) == [1, 3]
+    assert list(nodes.decode(np.array([2, 0]))) == [("a", 1), "x"]
+
+
+def test_to_csr_graph():
+    graph = g.build_two_cycles(2, 3, ("a", "b"))
+    graph = relabel_nodes(graph, lambda v: f"v{v}")
+    csr = g.to_csr_graph(graph)
+
+    assert list(csr.nodes) == list(graph.nodes)
+    assert g.to_csr_graph(csr) is csr
+
+    for label, m in zip(csr.labels, csr.matrices):
+        assert m.shape == (len(csr.nodes), len(csr.nodes))
+        assert {(csr.nodes[i], csr.nodes[j]) for i, j in zip(*m.nonzero())} == {
+            (u, v) for u, v, l in graph.edges(data="label") if l == label
+        }
+
+
+def test_load_csr_from_file():
+    with tempfile.NamedTemporaryFile(mode="w+", suffix=".csv") as f:
+        f.write("0 1 a\n1 2 b\n2 0 a\n1 2 b\n5 1 a\n")
+        f.flush()
+
+        expected = g.load_from_file(f.name)
+        graph = g.load_csr_from_file(f.name)
+
+    assert list(graph.nodes) == list(expected.nodes)
+    assert graph.labels == ["a", "b"]
+
+    mapping = {v: i for i, v in enumerate(graph.nodes)}
+    for label, m in zip(graph.labels, graph.matrices):
+        assert m.indices.dtype == np.int32
+        assert m.indptr.dtype == np.int32
+        assert set(zip(*m.nonzero())) == {
+            (mapping[u], mapping[v])
+            for u, v, l in expected.edges(data="label")
+            if l == label
+        }
+
+
+def test_load_csr_cached():
+    with tempfile.TemporaryDirectory() as cache_dir:
+        with tempfile.NamedTemporaryFile(mode="w+", suffix=".csv") as f:
+            f.write("0 1 a\n1 2 b\n2 0 a\n")
+            f.flush()
+
+            expected = g.load_csr_from_file(f.name)
+            graph = g.load_csr_cached(f.name, cache_dir)
+            cached = g.load_csr_cached(f.name, cache_dir)
+
+        assert len(os.listdir(cache_dir)) == 1
+
+        for result in (graph, cached):
+            assert isinstance(result.nodes, np.memmap)
+            assert list(result.nodes) == list(expected.nodes)
+            assert result.labels == expected.labels
+
+            for m, e in zip(result.matrices, expected.matrices):
+                assert (m != e).nnz == 0
+
+
+@pytest.mark.parametrize(
+    "content",
+    ["0 1 a\n1 x b\n2 0 a\n", "0 1 5\n1 2 6\n2 0 5\n", "0.5 True a\n1 x 7\n"],
+)
+def test_load_csr_cached_types(content):
+    with tempfile.TemporaryDirectory() as cache_dir:
+        with tempfile.NamedTemporaryFile(mode="w+", suffix=".csv") as f:
+            f.write(content)
+            f.flush()
+
+            expected = g.load_csr_from_file(f.name)
+            g.load_csr_cached(f.name, cache_dir)
+            cached = g.load_csr_cached(f.name, cache_dir)
+
+        assert [(type(v), v) for v in cached.nodes.tolist()] == [
+            (type(v), v) for v in expected.nodes.tolist()
+        ]
+        assert [(type(l), l) for l in cached.labels] == [
+            (type(l), l) for l in expected.labels
+        ]
+
+        nodes = g.NodeDictionary(cached.nodes)
+        assert list(nodes.encode(cached.nodes)) == list(range(len(cached.nodes)))
+
+
+def test_load_csr_cached_not_writable():
+    with tempfile.NamedTemporaryFile(mode="w+", suffix=".csv") as f:
+        f.write("0 1 a\n1 2 b\n")
+        f.flush()
+
+        # cache directory can't be created inside of file
+        graph = g.load_csr_cached(f.name, os.path.join(f.name, "cache"))
+
+    assert list(graph.nodes) == [0, 1, 2]
+    assert graph.labels == ["a", "b"]
+
+
 def test_load_by_name():
     graph = g.load_by_name("bzip")
     summary = g.summary(graph)
@@ -18,6 +188,33 @@ def test_load_by_name():
     assert summary == (632, 556, {"a", "d"})
 
 
+def test_prefetch(monkeypatch):
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "source", "graph")
+        os.makedirs(source)
+
+        with open(os.path.join(source, "tiny.csv"), "w") as f:
+            f.write("0 1 a\n1 2 b\n1 2 b\n")
+
+        monkeypatch.setattr(cfpq, "download", lambda name: os.path.dirname(source))
+        g.prefetch(["tiny"], os.path.join(tmp, "datasets"))
+
+        def offline(name):
+            raise ConnectionError("no network")
+
+        monkeypatch.setattr(cfpq, "download", offline)
+
+        graph = g.load_by_name("tiny", os.path.join(tmp, "datasets"))
+        assert g.summary(graph) == (3, 3, {"a", "b"})
+
+        graph = g.load_csr_by_name("tiny", os.path.join(tmp, "datasets"))
+        assert list(graph.nodes) == [0, 1, 2]
+        assert graph.labels == ["a", "b"]
+
+        with pytest.raises(ConnectionError):
+            g.load_by_name("tiny", os.path.join(tmp, "other"))
+
+
 def test_load_summary_by_name():
     assert g.load_summary_by_name("bzip") == (632, 556, {"a", "d"})
 
@@ -156,3 +353,16 @@ def test_build_two_cycles_and_write_dot():
 }
 """
     )
+
+
+def test_to_multidigraph():
+    graph = g.build_two_cycles(2, 3, ("a", "b"))
+    graph.add_node("isolated")
+
+    result = g.to_multidigraph(g.to_csr_graph(graph))
+
+    assert list(result.nodes) == list(graph.nodes)
+    assert sorted(result.edges(data="label"), key=str) == sorted(
+        graph.edges(data="label"), key=str
+    )
+    assert g.to_multidigraph(graph) is graph
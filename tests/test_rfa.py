@@ -1,7 +1,13 @@
+from pyformlang.cfg import Variable
+from pyformlang.finite_automaton import EpsilonNFA, State, Symbol
 import project.graphs as graphs
 from project.ecfg import ECFG
 import project.rfa as rfa
 import project.fa as fa
+import pytest
+import pickle
+import copy
+import io
 
 
 def test_Nonterminal():
@@ -11,6 +17,50 @@ def test_Nonterminal():
     assert rfa.Nonterminal("A") != "A"
 
 
+def test_Nonterminal_interned():
+    a = rfa.Nonterminal("A")
+
+    assert rfa.Nonterminal("A") is a
+    assert copy.deepcopy(a) is a
+    assert pickle.loads(pickle.dumps(a)) is a
+    assert hash(a) == hash(rfa.Nonterminal("A"))
+    assert repr(a) == "Nonterminal(value='A')"
+
+    assert rfa.Nonterminal("A") < rfa.Nonterminal("B")
+    assert rfa.Nonterminal("B") >= rfa.Nonterminal("A")
+    assert rfa.Nonterminal("A") < "B"
+    assert sorted([rfa.Nonterminal("B"), rfa.Nonterminal("A")]) == [
+        rfa.Nonterminal("A"),
+        rfa.Nonterminal("B"),
+    ]
+
+
+def test_Nonterminal_keeps_value_type():
+    variable = rfa.Nonterminal(Variable("S"))
+    text = rfa.Nonterminal("S")
+
+    assert isinstance(variable.value, Variable)
+    assert type(text.value) is str
+    assert variable == text and hash(variable) == hash(text)
+    assert rfa.Nonterminal(Variable("S")) is variable
+
+    flag = rfa.Nonterminal(True)
+    assert type(rfa.Nonterminal(1).value) is int
+    assert flag.value is True
+    assert rfa.Nonterminal("A") != "A"
+
+
+def test_SymbolTable():
+    table = rfa.SymbolTable(["a", rfa.Nonterminal("S")])
+
+    assert table["a"] == 0
+    assert table[rfa.Nonterminal("S")] == 1
+    assert table.add("b") == 2
+    assert table.add("a") == 0
+    assert len(table) == 3
+    assert "c" not in table
+
+
 def test_intersect_with_fa_one_nonterminal():
     graph = fa.graph_to_nfa(graphs.build_two_cycles(1, 2, ("a", "b")))
 
@@ -96,3 +146,123 @@ A -> a S b
         (1, rfa.Nonterminal("S"), 2),
         (1, rfa.Nonterminal("S"), 3),
     }
+
+
+def test_intersect_with_fa_boolean():
+    graph = graphs.build_two_cycles(1, 2, ("a", "b"))
+
+    grammar = ECFG.from_text("S -> a S b | epsilon").to_rfa().minimize()
+
+    result = rfa.intersect_with_fa(grammar, fa.graph_to_boolean_fa(graph))
+    expected = rfa.intersect_with_fa(grammar, fa.graph_to_nfa(graph))
+
+    assert isinstance(result, fa.BooleanFA)
+    assert set(fa.iterate_transitions(result.to_nfa())) == set(
+        fa.iterate_transitions(expected)
+    )
+
+
+def test_rfa_to_boolean_fa():
+    grammar = ECFG.from_text("S -> A b\nA -> a A | a").to_rfa().minimize()
+
+    result, boxes = grammar.to_boolean_fa()
+
+    sizes = [len(f.states) for f in grammar.fas.values()]
+    assert result.states_amount == sum(sizes)
+    assert list(boxes) == [k for k, size in enumerate(sizes) for _ in range(size)]
+
+    for l, m in result.boolean_matrices().items():
+        rows, cols = m.nonzero()
+        assert (boxes[rows] == boxes[cols]).all()
+
+
+def test_tensor_closure():
+    graph = graphs.build_two_cycles(1, 2, ("a", "b"))
+
+    grammar = ECFG.from_text("S -> a S b | epsilon").to_rfa().minimize()
+
+    graph = fa.graph_to_boolean_fa(graph)
+    result = rfa.tensor_closure(grammar, graph)
+
+    assert len(result.states) == result.closure.shape[0]
+
+    rows, cols = result.matrices[rfa.Nonterminal("S")].nonzero()
+    assert {(graph.states[i], graph.states[j]) for i, j in zip(rows, cols)} == {
+        (0, 0),
+        (0, 2),
+        (0, 3),
+        (1, 0),
+        (1, 1),
+        (1, 2),
+        (1, 3),
+        (2, 2),
+        (3, 3),
+    }
+
+    box = grammar.fas[rfa.Nonterminal("S")]
+    (start,) = box.start_states
+
+    reachable = {
+        result.states[j]
+        for i, j in zip(*result.closure.nonzero())
+        if result.states[i] == ((rfa.Nonterminal("S"), start), 1)
+    }
+    assert {v for (_, q), v in reachable if q in box.final_states} == {0, 2, 3}
+
+
+def test_save_load_rfa():
+    grammar = ECFG.from_text("S -> a S b | A | $\nA -> c A | d").to_rfa().minimize()
+
+    f = io.BytesIO()
+    rfa.save_rfa(grammar, f)
+    f.seek(0)
+    result = rfa.load_rfa(f)
+
+    assert result.start_state == grammar.start_state
+    assert result.fas.keys() == grammar.fas.keys()
+
+    for nt, box in grammar.fas.items():
+        assert result.fas[nt].is_equivalent_to(box)
+
+
+def test_save_load_rfa_epsilon():
+    grammar = ECFG.from_text("S -> a S b | a b*\nA -> (a | b)*").to_rfa()
+
+    f = io.BytesIO()
+    rfa.save_rfa(grammar, f)
+    f.seek(0)
+    result = rfa.load_rfa(f)
+
+    for nt, box in grammar.fas.items():
+        assert result.fas[nt].is_equivalent_to(box)
+
+    assert result.fas[rfa.Nonterminal("A")].accepts(["a", "b"])
+
+
+def test_save_load_rfa_non_string_symbols():
+    box = EpsilonNFA()
+    box.add_transition(State(0), Symbol(1), State(1))
+    box.add_transition(State(1), Symbol(rfa.Nonterminal("S")), State(2))
+    box.add_transition(State(2), Symbol(2.5), State(3))
+    box.add_start_state(State(0))
+    box.add_final_state(State(3))
+
+    grammar = rfa.RFA(rfa.Nonterminal(0), {rfa.Nonterminal(0): box})
+
+    f = io.BytesIO()
+    rfa.save_rfa(grammar, f)
+    f.seek(0)
+    result = rfa.load_rfa(f)
+
+    assert result.start_state == rfa.Nonterminal(0)
+    assert type(result.start_state.value) is int
+    assert result.fas.keys() == grammar.fas.keys()
+
+    box = result.fas[result.start_state]
+    labels = {(type(l.value), l.value) for _, l, _ in fa.iterate_transitions(box)}
+    assert labels == {(int, 1), (rfa.Nonterminal, rfa.Nonterminal("S")), (float, 2.5)}
+
+    grammar.fas[rfa.Nonterminal(0)].add_transition(State(3), Symbol((1, 2)), State(0))
+
+    with pytest.raises(TypeError):
+        rfa.save_rfa(grammar, io.BytesIO())